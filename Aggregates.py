@@ -0,0 +1,214 @@
+# -*- coding: utf-8 -*-
+#######################################################################
+###   Aggregates.py: Counts per country and dimension in-stream     ###
+###   Copyright:     Elena Daehnhardt                               ###
+###   Contact me at: edaehn@gmail.com                               ###
+#######################################################################
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# The Aggregates count the enriched rows as they are written, so that the
+# dashboards do not have to read the CSV files again:
+#
+#   the tweets per inferred country and dimension per minute (of Created At)
+#   for the last AGGREGATE_MINUTES minutes, and in total since the start
+#   the top AGGREGATE_TOP_K hashtags and user mentions per inferred country
+#   the tweets per inference strength
+#
+# The memory does not grow with the stream: the minutes are a rolling window,
+# the countries and dimensions are a few hundred, and the top hashtags and
+# mentions are kept with the Space-Saving algorithm in a fixed number of
+# counters per country. The Aggregates are a row sink of save_tweets.py: the
+# snapshot is written into a JSON file, replaced at once, every
+# AGGREGATE_INTERVAL seconds by a thread of its own, so that the writer of
+# the rows only counts them, and when closed. A collector which starts again
+# loads the snapshot it has saved and counts on from there, so the totals and
+# the tops cover all its runs; only the tops lose the counters below the
+# top AGGREGATE_TOP_K, which the snapshot does not keep.
+#
+# supervise_tweets.py adds up the snapshots of its collectors into the
+# aggregates.json of the main output directory with merge_snapshots().
+
+import os
+import sys
+import json
+import time
+import threading
+from config import *
+import Enrichment
+
+CREATED_AT_COLUMN=Enrichment.header.index('Created At')
+HASHTAGS_COLUMN=Enrichment.header.index('Hashtags')
+MENTIONS_COLUMN=Enrichment.header.index('User Mentions')
+
+class SpaceSaving:
+	'''Approximate top counts of a stream of items in size counters: a new item takes the counter
+	of the least counted one and its count, which is kept as the error bound of the new item'''
+
+	def __init__(self,size):
+		self.size=size
+		self.counts={}
+		self.errors={}
+
+	def add(self,item,count=1):
+		counts=self.counts
+		if item in counts:
+			counts[item]+=count
+		elif len(counts)<self.size:
+			counts[item]=count
+			self.errors[item]=0
+		else:
+			smallest=min(counts,key=counts.get)
+			minimum=counts.pop(smallest)
+			del self.errors[smallest]
+			counts[item]=minimum+count
+			self.errors[item]=minimum
+
+	def top(self,k):
+		'''Returns the k most counted items as [item, count, error], the count is at most error too high'''
+		items=sorted(self.counts.items(),key=lambda item: -item[1])[:k]
+		return [[item,count,self.errors[item]] for item,count in items]
+
+
+class Aggregates:
+	'''Windowed counters of the enriched rows, see the top of this file, saved into the JSON filename'''
+
+	def __init__(self,filename,minutes=AGGREGATE_MINUTES,top_k=AGGREGATE_TOP_K,interval=AGGREGATE_INTERVAL):
+		self.filename=filename
+		self.interval=interval
+		self.minutes=minutes
+		self.top_k=top_k
+		self.lock=threading.Lock()
+		self.window={} # 'YYYY-MM-DD HH:MM' -> {(country, dimension): tweets}
+		self.totals={} # (country, dimension) -> tweets
+		self.hashtags={} # country -> SpaceSaving
+		self.mentions={}
+		self.strengths={} # inference strength -> tweets
+		self.started=time.time()
+		if os.path.isfile(filename): self.load()
+		self.stopped=threading.Event()
+		self.saver=threading.Thread(target=self._save_every_interval, name='aggregates')
+		self.saver.daemon=True
+		self.saver.start()
+
+	def add(self,row):
+		'''Counts an enriched row'''
+		minute=row[CREATED_AT_COLUMN][:16]
+		country=row[Enrichment.INFERENCE_COLUMN]
+		key=(country,row[Enrichment.INFERENCE_COLUMN+1])
+		strength=row[Enrichment.INFERENCE_COLUMN+2]
+		with self.lock:
+			counts=self.window.get(minute)
+			if counts is None:
+				counts=self.window[minute]={}
+				while len(self.window)>self.minutes: del self.window[min(self.window)]
+			counts[key]=counts.get(key,0)+1
+			self.totals[key]=self.totals.get(key,0)+1
+			self.strengths[strength]=self.strengths.get(strength,0)+1
+			for column,tops in ((HASHTAGS_COLUMN,self.hashtags),(MENTIONS_COLUMN,self.mentions)):
+				if not row[column]: continue
+				top=tops.get(country)
+				if top is None: top=tops[country]=SpaceSaving(self.top_k*5) # more counters for a better top k
+				for item in row[column].lower().split(): top.add(item)
+
+	def snapshot(self):
+		'''The aggregates as a JSON-compatible dict, the countries and dimensions as "country/dimension"'''
+		def named(counts):
+			return dict(('%s/%s'%key,count) for key,count in counts.items())
+		with self.lock:
+			return {'updated':time.time(), 'started':self.started,
+				'minutes':dict((minute,named(counts)) for minute,counts in self.window.items()),
+				'totals':named(self.totals),
+				'hashtags':dict((country,top.top(self.top_k)) for country,top in self.hashtags.items()),
+				'mentions':dict((country,top.top(self.top_k)) for country,top in self.mentions.items()),
+				'strengths':dict((str(strength),count) for strength,count in self.strengths.items())}
+
+	def load(self):
+		'''Continues from the snapshot saved in the JSON file by an earlier run'''
+		try:
+			with open(self.filename) as f: snapshot=json.load(f)
+		except (IOError,ValueError) as e:
+			print >>sys.stderr, "Failed to load %s, counting from zero: %s"%(self.filename,e)
+			return
+		def keyed(counts):
+			# the rows hold UTF-8 strings, json returns unicode
+			return dict((tuple(_utf8(part) for part in name.rsplit('/',1)),count) for name,count in counts.items())
+		with self.lock:
+			self.started=snapshot['started']
+			for minute in sorted(snapshot['minutes'])[-self.minutes:]:
+				self.window[_utf8(minute)]=keyed(snapshot['minutes'][minute])
+			self.totals=keyed(snapshot['totals'])
+			self.strengths=dict((int(strength),count) for strength,count in snapshot['strengths'].items())
+			for dimension,tops in (('hashtags',self.hashtags),('mentions',self.mentions)):
+				for country,top in snapshot[dimension].items():
+					counters=tops[_utf8(country)]=SpaceSaving(self.top_k*5)
+					for item,count,error in top:
+						counters.counts[_utf8(item)]=count
+						counters.errors[_utf8(item)]=error
+
+	def write(self,row):
+		self.add(row)
+
+	def flush(self):
+		self.save()
+
+	def close(self):
+		if self.stopped.is_set(): return
+		self.stopped.set()
+		self.saver.join()
+		self.save()
+
+	def _save_every_interval(self):
+		while not self.stopped.wait(self.interval):
+			try:
+				self.save()
+			except (IOError,OSError) as e:
+				print >>sys.stderr, "Failed to save %s: %s"%(self.filename,e)
+
+	def save(self):
+		'''Writes the snapshot into the JSON file, replacing it at once'''
+		write_snapshot(self.filename,self.snapshot())
+
+
+def _utf8(value):
+	return value.encode('utf-8') if isinstance(value,unicode) else value
+
+def write_snapshot(filename,snapshot):
+	with open(filename+'.tmp','w') as f: json.dump(snapshot,f)
+	os.rename(filename+'.tmp',filename)
+
+def merge_snapshots(snapshots,minutes=AGGREGATE_MINUTES,top_k=AGGREGATE_TOP_K):
+	'''Adds up the snapshots of several collectors. The top hashtags and mentions are added up
+	from the tops of the snapshots, an item missing from the top of a collector counts 0 there.'''
+	merged={'updated':max([snapshot['updated'] for snapshot in snapshots] or [time.time()]),
+		'started':min([snapshot['started'] for snapshot in snapshots] or [time.time()]),
+		'minutes':{}, 'totals':{}, 'hashtags':{}, 'mentions':{}, 'strengths':{}}
+	def add(counts,more):
+		for key,count in more.items(): counts[key]=counts.get(key,0)+count
+	tops={'hashtags':{}, 'mentions':{}} # dimension -> country -> item -> [count, error]
+	for snapshot in snapshots:
+		for minute,counts in snapshot['minutes'].items(): add(merged['minutes'].setdefault(minute,{}),counts)
+		add(merged['totals'],snapshot['totals'])
+		add(merged['strengths'],snapshot['strengths'])
+		for dimension,countries in tops.items():
+			for country,top in snapshot[dimension].items():
+				items=countries.setdefault(country,{})
+				for item,count,error in top:
+					counts=items.setdefault(item,[0,0])
+					counts[0]+=count
+					counts[1]+=error
+	for minute in sorted(merged['minutes'])[:-minutes]: del merged['minutes'][minute]
+	for dimension,countries in tops.items():
+		for country,items in countries.items():
+			merged[dimension][country]=[[item,count,error] for item,(count,error) in
+				sorted(items.items(),key=lambda item: -item[1][0])[:top_k]]
+	return merged
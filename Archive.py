@@ -0,0 +1,324 @@
+# -*- coding: utf-8 -*-
+#######################################################################
+###   Archive.py:    Writing and reading the JSON archives          ###
+###   Copyright:     Elena Daehnhardt                               ###
+###   Contact me at: edaehn@gmail.com                               ###
+#######################################################################
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# The archives are newline-delimited JSON (one raw tweet per line, as received
+# from Twitter), optionally compressed with gzip or zstd. Every JSON_INDEX_EVERY
+# tweets a new block is started: a new gzip member or zstd frame, which can be
+# decompressed on its own. The sidecar index file <archive>.idx has a line
+# "offset<TAB>record" for every block, so readers can seek to a block and
+# split an archive into byte ranges for parallel processing.
+#
+# Older archives written with json.dump(data, f) are read by read_literals()
+# and converted with: python Archive.py twitter_YYYY-MM-DD.txt [...]
+
+import os
+import sys
+import json
+import gzip
+import zlib
+import time
+from config import *
+import Output
+from Metrics import metrics
+
+CHUNK_SIZE=1<<20
+EXTENSIONS={'':'.jsonl', 'gzip':'.jsonl.gz', 'zstd':'.jsonl.zst'}
+
+def compression_of(filename):
+	'''Returns the compression of an archive from its file name'''
+	if filename.endswith('.gz'): return 'gzip'
+	if filename.endswith('.zst'): return 'zstd'
+	return ''
+
+def _zstandard():
+	try:
+		import zstandard
+	except ImportError:
+		raise ImportError('JSON_COMPRESSION="zstd" needs the zstandard package: pip install zstandard')
+	return zstandard
+
+
+class _Plain:
+	'''Block writer for uncompressed archives'''
+
+	def __init__(self,f):
+		self.f=f
+		self.write=f.write
+
+	def flush(self):
+		self.f.flush()
+
+	def close(self):
+		self.f.flush()
+
+
+class _Zstd:
+	'''Block writer for zstd archives, every block is a zstd frame'''
+
+	def __init__(self,f):
+		self.zstandard=_zstandard()
+		self.writer=self.zstandard.ZstdCompressor().stream_writer(f)
+		self.write=self.writer.write
+
+	def flush(self):
+		self.writer.flush(self.zstandard.FLUSH_BLOCK)
+
+	def close(self):
+		self.writer.flush(self.zstandard.FLUSH_FRAME)
+
+
+class ArchiveSink(Output.BufferedSink):
+	'''Writes the raw tweets into a newline-delimited JSON archive with a block index.
+	The tweets are written as received, without decoding or encoding them again.'''
+
+	def __init__(self,filename,compression=JSON_COMPRESSION,index_every=JSON_INDEX_EVERY,**kwargs):
+		self.compression=compression
+		self.index_every=index_every
+		Output.BufferedSink.__init__(self,filename,**kwargs)
+
+	def open(self,filename,header=None):
+		self.filename=filename
+		self.f=open(filename,'ab')
+		self.index=open(filename+'.idx','ab')
+		self.block=None
+		self.records=count_records(filename) if os.path.getsize(filename) else 0
+		self.last_flush=time.time()
+
+	def _new_block(self):
+		if self.block is not None: self.block.close()
+		self.f.flush()
+		offset=os.fstat(self.f.fileno()).st_size
+		self.index.write('%d\t%d\n'%(offset,self.records))
+		self.index.flush()
+		if self.compression=='gzip':
+			self.block=gzip.GzipFile(fileobj=self.f,mode='wb')
+		elif self.compression=='zstd':
+			self.block=_Zstd(self.f)
+		else:
+			self.block=_Plain(self.f)
+
+	def write_rows(self,rows):
+		for data in rows:
+			if self.block is None or self.records%self.index_every==0: self._new_block()
+			if isinstance(data,unicode): data=data.encode('utf-8')
+			self.block.write(data.rstrip('\r\n'))
+			self.block.write('\n')
+			self.records+=1
+		self.block.flush()
+
+	def close(self):
+		with self.lock:
+			if self.f is None: return
+			self.flush()
+			if self.block is not None: self.block.close()
+			self.block=None
+			self.flush(sync=True)
+			self.f.close()
+			self.f=None
+			self.index.close()
+
+
+def read_index(filename):
+	'''Returns the list of (offset, record) of the archive blocks'''
+	index=[]
+	if os.path.isfile(filename+'.idx'):
+		with open(filename+'.idx') as f:
+			for line in f:
+				offset,record=line.split('\t')
+				index.append((int(offset),int(record)))
+	return index
+
+def count_records(filename):
+	'''Counts the tweets of an archive, decompressing only its last block'''
+	index=read_index(filename)
+	offset,records=index[-1] if index else (0,0)
+	try:
+		for _ in read_archive(filename,offset): records+=1
+	except (IOError,zlib.error) as e:
+		if PRINT_DEBUG: print "Last block of %s is incomplete: %s"%(filename,e)
+	return records
+
+def shards(filename,shard_bytes):
+	'''Splits an archive into (start, end, first record) byte ranges of about shard_bytes at block boundaries'''
+	size=os.path.getsize(filename)
+	index=read_index(filename) or [(0,0)]
+	ranges=[]
+	start,first=index[0]
+	for offset,record in index[1:]:
+		if offset-start>=shard_bytes:
+			ranges.append((start,offset,first))
+			start,first=offset,record
+	ranges.append((start,size,first))
+	return ranges
+
+def _read_range(f,start,end,chunk_size=CHUNK_SIZE):
+	f.seek(start)
+	left=end-start
+	while left>0:
+		chunk=f.read(min(chunk_size,left))
+		if not chunk: return
+		left-=len(chunk)
+		yield chunk
+
+def _gunzip(chunks):
+	# gzip.GzipFile seeks to the end of the file to find the last member,
+	# decompress the members of the byte range with zlib instead
+	d=zlib.decompressobj(16+zlib.MAX_WBITS)
+	for chunk in chunks:
+		data=d.decompress(chunk)
+		while d.unused_data:
+			rest=d.unused_data
+			d=zlib.decompressobj(16+zlib.MAX_WBITS)
+			data+=d.decompress(rest)
+		yield data
+
+def _unzstd(chunks):
+	d=_zstandard().ZstdDecompressor()
+	obj=d.decompressobj()
+	for chunk in chunks:
+		while chunk:
+			data=obj.decompress(chunk)
+			chunk=obj.unused_data if obj.eof else ''
+			if obj.eof: obj=d.decompressobj()
+			yield data
+
+def read_archive(filename,start=0,end=None,chunk_size=CHUNK_SIZE):
+	'''Reads the raw tweets of a newline-delimited JSON archive between
+	the byte offsets start and end, which must be block boundaries.
+
+	Returns: generator of raw tweets
+	'''
+	compression=compression_of(filename)
+	with open(filename,'rb') as f:
+		if end is None: end=os.fstat(f.fileno()).st_size
+		chunks=_read_range(f,start,end,chunk_size)
+		if compression=='gzip': chunks=_gunzip(chunks)
+		elif compression=='zstd': chunks=_unzstd(chunks)
+		rest=''
+		for chunk in chunks:
+			lines=(rest+chunk).split('\n')
+			rest=lines.pop()
+			for line in lines:
+				if line: yield line
+		if rest: yield rest
+
+def _record_start(buf,pos):
+	'''Index of the first record starting after pos, -1 when none: a raw tweet is a JSON object,
+	so a record starts with a quote, which is not escaped, followed by {'''
+	while True:
+		pos=buf.find('"{',pos)
+		if pos<0: return -1
+		backslashes=0
+		while pos>backslashes and buf[pos-backslashes-1]=='\\': backslashes+=1
+		if backslashes%2==0: return pos
+		pos+=1
+
+def read_literals(f,offset=0,chunk_size=CHUNK_SIZE,max_record=2*STREAM_MAX_MESSAGE):
+	'''Reads an archive written by json.dump(data, f) one tweet after another,
+	where every raw tweet is a JSON string literal. Only chunk_size bytes
+	are read at once, so the archives never have to fit into memory.
+
+	A collector killed while writing leaves a partial record, followed by
+	the records of the next run appending to the same file. Such a record,
+	and bytes without a record start within max_record bytes, are skipped
+	and reported, the reading goes on from the next record (a partial
+	record ending with a backslash takes the next record with it).
+
+	Inputs:
+	f: archive file opened in binary mode and positioned at offset
+	offset: file offset of the first record to be read
+	max_record: longest record, a raw tweet of STREAM_MAX_MESSAGE bytes escaped
+
+	Returns: generator of (offset after the record, raw tweet)
+	'''
+	decoder=json.JSONDecoder()
+	buf=''
+	base=offset # file offset of buf[0]
+	while True:
+		chunk=f.read(chunk_size)
+		buf+=chunk
+		pos=0
+		while True:
+			while pos<len(buf) and buf[pos] in ' \t\r\n': pos+=1
+			if pos==len(buf): break
+			try:
+				data,end=decoder.raw_decode(buf,pos)
+				following=end
+				while following<len(buf) and buf[following] in ' \t\r\n': following+=1
+				if following==len(buf) and chunk: break # the next record may show that this one is cut off
+				# a partial record ends at the opening quote of the next one, not before it
+				complete=following==len(buf) or buf[following]=='"'
+			except ValueError:
+				complete=False
+			if complete:
+				yield base+end,data
+				pos=end
+				continue
+			start=_record_start(buf,pos+1)
+			if start<0: break # the record continues in the next chunk
+			_skipped(base+pos,start-pos)
+			pos=start
+		buf=buf[pos:]
+		base+=pos
+		if not chunk:
+			# a collector killed while writing leaves a partial record at the end
+			if buf.strip(): _skipped(base,len(buf))
+			return
+		if len(buf)>max_record:
+			# no record in max_record bytes, the last byte may be the quote of the next one
+			_skipped(base,len(buf)-1)
+			base+=len(buf)-1
+			buf=buf[-1:]
+
+def _skipped(offset,size):
+	metrics.inc('skipped_records')
+	print >>sys.stderr, "Skipping %d bytes of a partial record at offset %d"%(size,offset)
+
+def compress(filename):
+	'''Gzips a closed uncompressed archive with its block index and removes it'''
+	output=filename[:-len(EXTENSIONS[''])]+EXTENSIONS['gzip']
+	tmp=output+'.tmp'
+	for name in (tmp,tmp+'.idx'):
+		if os.path.exists(name): os.remove(name) # left by an interrupted compression
+	sink=ArchiveSink(tmp,compression='gzip',flush_rows=10000)
+	for data in read_archive(filename):
+		sink.write(data)
+	sink.close()
+	os.rename(tmp+'.idx',output+'.idx')
+	os.rename(tmp,output)
+	os.remove(filename)
+	if os.path.exists(filename+'.idx'): os.remove(filename+'.idx')
+
+def convert(filename,compression=JSON_COMPRESSION):
+	'''Converts an archive of JSON string literals into a newline-delimited JSON archive next to it'''
+	output=os.path.splitext(filename)[0]+EXTENSIONS[compression]
+	sink=ArchiveSink(output,compression=compression,flush_rows=10000)
+	with open(filename,'rb') as f:
+		for _,data in read_literals(f):
+			sink.write(data)
+	sink.close()
+	return output,sink.records
+
+
+if __name__ == '__main__':
+	if len(sys.argv)<2:
+		print "Usage: python Archive.py twitter_YYYY-MM-DD.txt [...]"
+		sys.exit(1)
+	for filename in sys.argv[1:]:
+		output,records=convert(filename)
+		print "%s: %d tweets converted into %s"%(filename,records,output)
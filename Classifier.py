@@ -16,6 +16,10 @@
 # limitations under the License.
 
 from Locality import *
+from config import CLASSIFIER_CACHE_SIZE, CLASSIFIER_CACHE_TTL
+from collections import OrderedDict
+import threading
+import time
 
 class Classifier:
 	
@@ -31,6 +35,23 @@ class Classifier:
 		
 		return country,getLocality(country)[0]
 
+	def ClassifyBatch(self,texts):
+		'''Classifies a list of meta texts with a single predict call
+	
+		Inputs:
+		texts: list of meta texts (user language, time zone and location)
+	
+		Returns: list of countries and list of their dimensions
+		'''
+		if not len(texts): return [],[]
+		country_ids=self.classifier.predict(texts)
+		
+		countries = self.labels['Country']
+		names=dict((country_id,str(countries.loc[country_id][0])) for country_id in set(country_ids))
+		batch_countries=[names[country_id] for country_id in country_ids]
+		
+		return batch_countries,getLocalities(batch_countries)[0]
+
 		
 	def loadClassifier(self,filename):
 		'''Loads a classification model from the specified file
@@ -44,5 +65,75 @@ class Classifier:
 		from sklearn.externals import joblib
 		clf = joblib.load(filename)
 		return clf
-	
 
+
+class CachedClassifier:
+	'''Keeps the last inferred countries of a Classifier in a LRU cache.
+	The meta texts repeat a lot (same users, "en London" and alike), so most
+	tweets do not need to call the model at all.
+
+	Inputs:
+	classifier: Classifier to be cached
+	size: maximum number of cached meta texts
+	ttl: seconds after which a cached result expires, 0 for never
+	'''
+
+	def __init__(self,classifier,size=CLASSIFIER_CACHE_SIZE,ttl=CLASSIFIER_CACHE_TTL):
+		self.classifier=classifier
+		self.size=size
+		self.ttl=ttl
+		self.cache=OrderedDict()
+		self.lock=threading.Lock()
+		self.counters={'hits':0, 'misses':0, 'evictions':0, 'expired':0}
+
+	def normalise(self,text):
+		return ' '.join(text.split())
+
+	def _get(self,key):
+		# must be called with the lock held
+		entry=self.cache.pop(key,None)
+		if entry is None:
+			self.counters['misses']+=1
+			return None
+		result,expires=entry
+		if expires and expires<time.time():
+			self.counters['expired']+=1
+			self.counters['misses']+=1
+			return None
+		self.cache[key]=entry # moves the key to the most recently used end
+		self.counters['hits']+=1
+		return result
+
+	def _put(self,key,result):
+		# must be called with the lock held
+		self.cache.pop(key,None)
+		self.cache[key]=(result,time.time()+self.ttl if self.ttl else 0)
+		while len(self.cache)>self.size:
+			self.cache.popitem(last=False)
+			self.counters['evictions']+=1
+
+	def ClassifyTextToCountryDimension(self,text):
+		key=self.normalise(text)
+		with self.lock:
+			result=self._get(key)
+		if result is None:
+			result=self.classifier.ClassifyTextToCountryDimension(key)
+			with self.lock:
+				self._put(key,result)
+		return result
+
+	def ClassifyBatch(self,texts):
+		keys=[self.normalise(text) for text in texts]
+		results=[None]*len(keys)
+		missing=OrderedDict() # meta text -> positions in the batch
+		with self.lock:
+			for i,key in enumerate(keys):
+				results[i]=self._get(key)
+				if results[i] is None: missing.setdefault(key,[]).append(i)
+		if missing:
+			countries,dimensions=self.classifier.ClassifyBatch(list(missing))
+			with self.lock:
+				for (key,positions),result in zip(missing.items(),zip(countries,dimensions)):
+					self._put(key,result)
+					for i in positions: results[i]=result
+		return [country for country,_ in results],[dimension for _,dimension in results]
@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+#######################################################################
+###   Corpus.py:     Raw tweet corpora for the benchmarks           ###
+###   Copyright:     Elena Daehnhardt                               ###
+###   Contact me at: edaehn@gmail.com                               ###
+#######################################################################
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# The benchmarks run over the raw tweets recorded by save_tweets.py with
+# SAFE_JSON=True. Without a recorded archive they use synthetic tweets with
+# the structure and about the size (4-5 KB) of the tweets of the stream.
+
+import re
+import json
+import random
+import itertools
+from config import *
+import Archive
+
+LANGUAGES=['en', 'es', 'ar', 'ja', 'pt', 'fr', 'de', 'tr', 'ru', 'it']
+LOCATIONS=[u'London, UK', u'New York', u'México', u'東京', u'São Paulo', u'Paris', u'Berlin, Deutschland', u'', u'Istanbul', u'Москва']
+TIME_ZONES=['London', 'Eastern Time (US & Canada)', 'Mexico City', 'Tokyo', 'Brasilia', 'Paris', 'Berlin', None, 'Istanbul', 'Moscow']
+WORDS=u'the news today world love time people life music game photo video follow happy new día año مرحبا こんにちは você heute'.split()
+
+def load_corpus(filenames,limit=None):
+	'''Reads the raw tweets of the JSON archives, newline-delimited or older ones of JSON string literals
+
+	Inputs:
+	filenames: list of archive files
+	limit: maximal number of tweets, all by default
+
+	Returns: list of raw tweets
+	'''
+	def tweets():
+		for filename in filenames:
+			if filename.endswith('.txt'):
+				with open(filename,'rb') as f:
+					for _,data in Archive.read_literals(f): yield data
+			else:
+				for data in Archive.read_archive(filename): yield data
+	return list(itertools.islice(tweets(),limit))
+
+def _user(rand,i):
+	language=rand.randrange(len(LANGUAGES))
+	place=rand.randrange(len(LOCATIONS))
+	return {'id':i, 'id_str':str(i), 'name':u'User %d'%i, 'screen_name':'user%d'%i,
+		'location':LOCATIONS[place], 'url':rand.choice([None, 'http://example.com/%d'%i]),
+		'description':u' '.join(rand.choice(WORDS) for _ in range(rand.randrange(20))),
+		'translator_type':'none', 'protected':False, 'verified':rand.random()<0.01,
+		'followers_count':rand.randrange(100000), 'friends_count':rand.randrange(5000),
+		'listed_count':rand.randrange(100), 'favourites_count':rand.randrange(10000),
+		'statuses_count':rand.randrange(100000), 'created_at':'Mon Mar 05 12:01:17 +0000 2012',
+		'utc_offset':None, 'time_zone':TIME_ZONES[place], 'geo_enabled':rand.random()<0.3,
+		'lang':LANGUAGES[language], 'contributors_enabled':False, 'is_translator':False,
+		'profile_background_color':'C0DEED', 'profile_background_image_url':'http://abs.twimg.com/images/themes/theme1/bg.png',
+		'profile_background_image_url_https':'https://abs.twimg.com/images/themes/theme1/bg.png',
+		'profile_background_tile':False, 'profile_link_color':'1DA1F2', 'profile_sidebar_border_color':'C0DEED',
+		'profile_sidebar_fill_color':'DDEEF6', 'profile_text_color':'333333', 'profile_use_background_image':True,
+		'profile_image_url':'http://pbs.twimg.com/profile_images/%d/photo_normal.jpg'%i,
+		'profile_image_url_https':'https://pbs.twimg.com/profile_images/%d/photo_normal.jpg'%i,
+		'profile_banner_url':'https://pbs.twimg.com/profile_banners/%d/1520000000'%i,
+		'default_profile':True, 'default_profile_image':False, 'following':None, 'follow_request_sent':None, 'notifications':None}
+
+def synthetic_tweets(n,seed=0):
+	'''Returns n raw tweets with the structure of the tweets of the stream'''
+	rand=random.Random(seed)
+	corpus=[]
+	for i in range(n):
+		words=[rand.choice(WORDS) for _ in range(rand.randrange(5,25))]
+		hashtags=[{'text':rand.choice(WORDS), 'indices':[0,5]} for _ in range(rand.randrange(3))]
+		mentions=[{'screen_name':'user%d'%rand.randrange(n), 'name':'User', 'id':j, 'id_str':str(j), 'indices':[0,5]}
+			for j in range(rand.randrange(3))]
+		urls=[{'url':'https://t.co/abc%d'%j, 'expanded_url':'http://example.com/%d/%d'%(i,j),
+			'display_url':'example.com/%d'%j, 'indices':[0,5]} for j in range(rand.randrange(2))]
+		place=None
+		if rand.random()<0.1:
+			place={'id':'%x'%i, 'url':'https://api.twitter.com/1.1/geo/id/%x.json'%i, 'place_type':'city',
+				'name':'City', 'full_name':'City, Country', 'country_code':rand.choice(['GB', 'US', 'MX', 'JP', 'BR']),
+				'country':'Country', 'bounding_box':{'type':'Polygon', 'coordinates':[[[-0.5,51.3],[-0.5,51.7],[0.3,51.7],[0.3,51.3]]]},
+				'attributes':{}}
+		tweet={'created_at':'Wed Oct 10 20:19:%02d +0000 2018'%(i%60), 'id':1050000000000000000+i,
+			'id_str':str(1050000000000000000+i), 'text':u' '.join(words),
+			'source':'<a href="http://twitter.com/download/android" rel="nofollow">Twitter for Android</a>',
+			'truncated':False, 'in_reply_to_status_id':None, 'in_reply_to_status_id_str':None,
+			'in_reply_to_user_id':None, 'in_reply_to_user_id_str':None, 'in_reply_to_screen_name':None,
+			'user':_user(rand,rand.randrange(n)), 'geo':None, 'coordinates':None, 'place':place,
+			'contributors':None, 'is_quote_status':False, 'quote_count':0, 'reply_count':0,
+			'retweet_count':0, 'favorite_count':0,
+			'entities':{'hashtags':hashtags, 'urls':urls, 'user_mentions':mentions, 'symbols':[]},
+			'favorited':False, 'retweeted':False, 'filter_level':'low', 'lang':rand.choice(LANGUAGES),
+			'timestamp_ms':str(1539202764000+i)}
+		if rand.random()<0.3:
+			# retweets carry the whole original tweet
+			retweeted=dict(tweet, user=_user(rand,rand.randrange(n)))
+			tweet['retweeted_status']=retweeted
+		corpus.append(json.dumps(tweet))
+	return corpus
+
+# The ids of the tweet and its user in the template of a raw tweet, see cycled()
+ID_FIELDS=re.compile(r'"@@(tweet_id|tweet_id_str|user_id|user_id_str)@@"')
+ROUND_STEP=0x9E3779B97F4A7C15 # odd, so the ids of an id in every round are different
+
+def _template(data):
+	'''Splits a raw tweet at the ids of the tweet and its user: the parts between them and their names'''
+	tweet=json.loads(data)
+	user=tweet.get('user') or {}
+	ids={'tweet':int(tweet.get('id') or 0), 'user':int(user.get('id') or 0)}
+	tweet['id'],tweet['id_str']='@@tweet_id@@','@@tweet_id_str@@'
+	if user: user['id'],user['id_str']='@@user_id@@','@@user_id_str@@'
+	return ID_FIELDS.split(json.dumps(tweet)),ids
+
+def cycled(corpus,n):
+	'''Returns a generator of n raw tweets, repeating the corpus with new ids of the tweets and
+	of their users in every round, so that the Deduplicator and the caches by user id keep seeing
+	new keys as in a stream running for weeks. The ids stay positive 64-bit integers.'''
+	corpus=corpus[:n]
+	# the templates are made here, not while the tweets are timed
+	templates=[_template(data) for data in corpus] if n>len(corpus) else []
+	def tweets():
+		for data in corpus: yield data
+		for number in xrange(len(corpus),n if corpus else 0):
+			parts,ids=templates[number%len(corpus)]
+			offset=number//len(corpus)*ROUND_STEP
+			values={}
+			for name in ('tweet','user'):
+				values[name+'_id']=str((ids[name]+offset)%(1<<63))
+				values[name+'_id_str']='"%s"'%values[name+'_id']
+			yield ''.join(values[part] if index%2 else part for index,part in enumerate(parts))
+	return tweets()
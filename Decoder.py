@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+#######################################################################
+###   Decoder.py:    Pluggable JSON decoders for the tweets         ###
+###   Copyright:     Elena Daehnhardt                               ###
+###   Contact me at: edaehn@gmail.com                               ###
+#######################################################################
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Decoding the tweets is the main CPU cost of the collector. The decoders are
+# tried in the order of BACKENDS when JSON_DECODER='auto': orjson, simdjson
+# (pysimdjson), ujson and the standard json module, which is always available.
+#
+# With partial=True only the parts of the tweet listed in FIELDS are returned.
+# The simdjson decoder then materializes only these subtrees of its lazily
+# parsed document; the other decoders decode everything and keep these parts,
+# so the rest of the tweet can be freed at once.
+
+import json
+import threading
+from config import *
+
+BACKENDS=['orjson', 'simdjson', 'ujson', 'json']
+
+# The parts of a tweet used by the collector
+FIELDS=('created_at', 'id', 'text', 'user', 'place', 'entities')
+
+def _json():
+	return json.loads
+
+def _orjson():
+	import orjson
+	return orjson.loads
+
+def _ujson():
+	import ujson
+	return ujson.loads
+
+def _simdjson_parser():
+	import simdjson
+	local=threading.local() # a parser and its documents must not be shared by threads
+	def parser():
+		if not hasattr(local,'parser'): local.parser=simdjson.Parser()
+		return local.parser
+	return simdjson,parser
+
+def _simdjson():
+	simdjson,parser=_simdjson_parser()
+	def loads(data):
+		return parser().parse(data,True)
+	return loads
+
+def _simdjson_partial(fields):
+	simdjson,parser=_simdjson_parser()
+	def materialize(value):
+		if isinstance(value,simdjson.Object): return value.as_dict()
+		if isinstance(value,simdjson.Array): return value.as_list()
+		return value
+	def loads(data):
+		document=parser().parse(data)
+		if not isinstance(document,simdjson.Object): return materialize(document)
+		return dict((field,materialize(document[field])) for field in fields if field in document)
+	return loads
+
+_LOADERS={'json':_json, 'orjson':_orjson, 'ujson':_ujson, 'simdjson':_simdjson}
+
+def available():
+	'''Returns the names of the decoders which can be used here'''
+	names=[]
+	for name in BACKENDS:
+		try:
+			_LOADERS[name]()
+			names.append(name)
+		except ImportError:
+			pass
+	return names
+
+def get_decoder(name=JSON_DECODER,partial=JSON_PARTIAL,fields=FIELDS):
+	'''Returns a function decoding a raw tweet.
+
+	Inputs:
+	name: one of BACKENDS or 'auto' for the first available of them
+	partial: True to decode only the fields of the tweet
+	fields: the top-level fields kept with partial=True
+
+	Returns: loads(data) function
+	'''
+	if name=='auto': name=available()[0]
+	if name not in _LOADERS: raise ValueError('Unknown JSON decoder %s, use one of %s'%(name,', '.join(BACKENDS)))
+	if partial and name=='simdjson': return _simdjson_partial(fields)
+	loads=_LOADERS[name]()
+	if not partial: return loads
+	def loads_partial(data):
+		tweet=loads(data)
+		if not isinstance(tweet,dict): return tweet
+		return dict((field,tweet[field]) for field in fields if field in tweet)
+	return loads_partial
@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+#######################################################################
+###   Dedup.py:      Dropping the tweets received more than once    ###
+###   Copyright:     Elena Daehnhardt                               ###
+###   Contact me at: edaehn@gmail.com                               ###
+#######################################################################
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# The stream sends some tweets again after a reconnect, and a tweet matching
+# the keywords of several streams comes with each of them. The Deduplicator
+# remembers the tweet ids in a fixed amount of memory, so the collector can
+# run for weeks: the last ids exactly, the older ones in two Bloom filters.
+# When the newer filter is full, the older one is dropped and a new one is
+# started, so the ids of about the last two filter capacities are remembered.
+# A Bloom filter may take a new id for one already seen (a false positive),
+# such tweets are lost; false_positive_rate() gives the current probability.
+
+import math
+import threading
+from collections import OrderedDict
+from config import *
+
+MASK=(1<<64)-1
+
+def _mix(key):
+	'''64-bit hash of an integer, the splitmix64 finalizer'''
+	z=(key+0x9E3779B97F4A7C15)&MASK
+	z=((z^(z>>30))*0xBF58476D1CE4E5B9)&MASK
+	z=((z^(z>>27))*0x94D049BB133111EB)&MASK
+	return z^(z>>31)
+
+
+class BloomFilter:
+	'''Bloom filter of integers with bits bits and hashes hash functions'''
+
+	def __init__(self,bits,hashes):
+		self.bits=bits
+		self.hashes=hashes
+		self.array=bytearray((bits+7)//8)
+		self.count=0 # number of ids added
+		self.set_bits=0
+
+	def _positions(self,key):
+		h=_mix(key)
+		h1,h2=h&0xffffffff,(h>>32)|1
+		return [(h1+i*h2)%self.bits for i in range(self.hashes)]
+
+	def __contains__(self,key):
+		array=self.array
+		for position in self._positions(key):
+			if not array[position>>3]&(1<<(position&7)): return False
+		return True
+
+	def add(self,key):
+		array=self.array
+		for position in self._positions(key):
+			bit=1<<(position&7)
+			if not array[position>>3]&bit:
+				array[position>>3]|=bit
+				self.set_bits+=1
+		self.count+=1
+
+	def false_positive_rate(self):
+		'''Probability that an id which was not added is found, from the share of set bits'''
+		return (float(self.set_bits)/self.bits)**self.hashes
+
+
+class Deduplicator:
+	'''Tells whether a tweet id was seen before.
+
+	Inputs:
+	memory_mb: memory of the two Bloom filters together in MB
+	recent: number of the last ids kept exactly
+	fp_rate: false positive rate of a full Bloom filter, which sets its capacity
+	'''
+
+	def __init__(self,memory_mb=DEDUP_MEMORY_MB,recent=DEDUP_RECENT,fp_rate=DEDUP_FP_RATE):
+		self.bits=max(64,int(memory_mb*8*1024*1024)//2)
+		# the optimal capacity and number of hash functions for the false positive rate
+		self.capacity=max(1,int(-self.bits*math.log(2)**2/math.log(fp_rate)))
+		self.hashes=max(1,int(round(float(self.bits)/self.capacity*math.log(2))))
+		self.current=BloomFilter(self.bits,self.hashes)
+		self.previous=None
+		self.recent_size=recent
+		self.recent=OrderedDict()
+		self.lock=threading.Lock()
+		self.counters={'checked':0, 'duplicates':0, 'recent_hits':0, 'filter_hits':0, 'rotations':0}
+
+	def seen(self,tweet_id):
+		'''Returns True when the tweet id was seen before, otherwise remembers it.
+		Tweets without an id (None) are never duplicates.'''
+		if tweet_id is None: return False
+		key=int(tweet_id)
+		with self.lock:
+			self.counters['checked']+=1
+			if key in self.recent:
+				self.counters['recent_hits']+=1
+				self.counters['duplicates']+=1
+				return True
+			if key in self.current or (self.previous is not None and key in self.previous):
+				self.counters['filter_hits']+=1
+				self.counters['duplicates']+=1
+				return True
+			self.recent[key]=None
+			if len(self.recent)>self.recent_size: self.recent.popitem(last=False)
+			if self.current.count>=self.capacity:
+				self.previous,self.current=self.current,BloomFilter(self.bits,self.hashes)
+				self.counters['rotations']+=1
+			self.current.add(key)
+			return False
+
+	def false_positive_rate(self):
+		'''Current probability that a new tweet is taken for a duplicate'''
+		with self.lock:
+			rate=self.current.false_positive_rate()
+			if self.previous is not None: rate=1-(1-rate)*(1-self.previous.false_positive_rate())
+		return rate
+
+	def stats(self):
+		'''Returns the counters with the false positive rate and the memory used'''
+		stats=dict(self.counters)
+		stats['false_positive_rate']=self.false_positive_rate()
+		stats['filter_mb']=2*len(self.current.array)/1048576.
+		stats['capacity']=self.capacity
+		return stats
@@ -0,0 +1,328 @@
+# -*- coding: utf-8 -*-
+#######################################################################
+###   Enrichment.py: Building the CSV rows with country inference   ###
+###   Copyright:     Elena Daehnhardt                               ###
+###   Contact me at: edaehn@gmail.com                               ###
+#######################################################################
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import threading
+from collections import OrderedDict
+from config import *
+import Decoder
+from Metrics import metrics, sampled
+from Locality import getDimension
+
+header=['Created At', 'User Id', 'User Language', 'User timezone',
+	'User Location', 'User Place Country Code from Twitter',
+	'User URL', 'User Description', 'User name', 'User Screen Name', 'Tweet',
+	'Inferred Country', 'Inferred Dimension', 'Inference Strength',
+	'Ratio of Followers', 'Hashtags', 'User Mentions', 'URLs', 'Media', 'Model Version']
+# Column types for the typed outputs: 'category' columns have few distinct values
+column_types=['datetime', 'int', 'category', 'category',
+	'string', 'category',
+	'string', 'string', 'string', 'string', 'string',
+	'category', 'category', 'int',
+	'float', 'string', 'string', 'string', 'string', 'category']
+LANGUAGE_COLUMN=2 # User Language, followed by User timezone and User Location which make the meta text
+INFERENCE_COLUMN=11 # position of the Inferred Country in the row, see Enricher.infer()
+MODEL_VERSION_COLUMN=19 # the model which inferred the country, empty when there was no inference
+DUPLICATE='duplicate' # given by Enricher.process() instead of the row of a tweet seen before
+FILTERED='filtered' # given by Enricher.process() instead of the row of a control message or a dropped tweet
+
+MONTHS={'Jan':1, 'Feb':2, 'Mar':3, 'Apr':4, 'May':5, 'Jun':6, 'Jul':7, 'Aug':8, 'Sep':9, 'Oct':10, 'Nov':11, 'Dec':12}
+
+def created_at(value):
+	"""Converts 'Wed Oct 10 20:19:24 +0000 2018' into '2018-10-10 20:19:24'"""
+	parts=value.split(' ')
+	if len(parts)!=6 or parts[1] not in MONTHS: return ''
+	return '%s-%02d-%s %s'%(parts[5], MONTHS[parts[1]], parts[2], parts[3])
+
+def utf8(value):
+	return value.encode('utf-8') if isinstance(value, unicode) else value
+
+def followers_ratio(user):
+	followers=user.get('followers_count') or 0
+	friends=user.get('friends_count') or 0
+	if followers+friends>0: return float(followers)/(followers+friends)
+	return 0
+
+def joined(key):
+	"""Joins the key of all entities of a kind, as the hashtag texts"""
+	def join(entities):
+		return utf8(' '.join([entity[key] for entity in entities if isinstance(entity, dict) and entity.get(key)]))
+	return join
+
+# Where the columns of the row are in the tweet: (column, JSON path, default, conversion).
+# A missing or null field gives the default, the conversion is applied to the other values.
+# The columns without a path are set by Enricher.infer().
+fields=[('Created At', ('created_at',), '', created_at),
+	('User Id', ('user', 'id'), '', None),
+	('User Language', ('user', 'lang'), '', utf8),
+	('User timezone', ('user', 'time_zone'), '', utf8),
+	('User Location', ('user', 'location'), '', utf8),
+	('User Place Country Code from Twitter', ('place', 'country_code'), '', utf8),
+	('User URL', ('user', 'url'), '', utf8),
+	('User Description', ('user', 'description'), '', utf8),
+	('User name', ('user', 'name'), '', utf8),
+	('User Screen Name', ('user', 'screen_name'), '', utf8),
+	('Tweet', ('text',), '', utf8),
+	('Inferred Country', None, '', None),
+	('Inferred Dimension', None, '', None),
+	('Inference Strength', None, 0, None),
+	('Ratio of Followers', ('user',), 0, followers_ratio),
+	('Hashtags', ('entities', 'hashtags'), '', joined('text')),
+	('User Mentions', ('entities', 'user_mentions'), '', joined('screen_name')),
+	('URLs', ('entities', 'urls'), '', joined('expanded_url')),
+	('Media', ('entities', 'media'), '', joined('media_url')),
+	('Model Version', None, '', None)]
+assert [field[0] for field in fields]==header
+
+def compile_path(path):
+	"""Returns a function reading the JSON path from a decoded tweet, None when it is missing"""
+	if path is None: return None
+	def get(status):
+		value=status
+		for key in path:
+			if not isinstance(value, dict): return None
+			value=value.get(key)
+		return value
+	return get
+
+extractors=[(compile_path(path), default, convert) for _, path, default, convert in fields]
+
+# The columns from the user profile, the same for all the tweets of a user until the profile changes.
+# The Ratio of Followers changes with every tweet, it is extracted like the columns of the tweet.
+USER_COLUMNS=[column for column, (_, path, _, _) in enumerate(fields) if path is not None and len(path)==2 and path[0]=='user']
+PROFILE_FIELDS=[fields[column][1][1] for column in USER_COLUMNS]
+TWEET_COLUMNS=[column for column in range(len(fields)) if column not in USER_COLUMNS]
+
+
+class Profile:
+	"""The user columns of a user, with their inference (version, country, dimension, strength) once classified"""
+	__slots__=('key', 'columns', 'missing', 'inference')
+
+	def __init__(self, key, columns, missing):
+		self.key=key
+		self.columns=columns
+		self.missing=missing
+		self.inference=None
+
+
+class ProfileCache:
+	"""LRU cache of the Profiles of the last size users by user id. Heavy posters make up a
+	large share of the stream, their tweets then only need the tweet columns extracted.
+	A profile is replaced when the hash of its PROFILE_FIELDS has changed."""
+
+	def __init__(self, size=PROFILE_CACHE_SIZE):
+		self.size=size
+		self.profiles=OrderedDict()
+		self.lock=threading.Lock()
+		self.counters={'hits':0, 'misses':0, 'changed':0, 'evictions':0}
+
+	def get(self, user_id, key):
+		"""Returns the profile of the user if its fields hash to key, otherwise None"""
+		with self.lock:
+			profile=self.profiles.pop(user_id, None)
+			if profile is None or profile.key!=key:
+				if profile is not None: self.counters['changed']+=1
+				self.counters['misses']+=1
+				return None
+			self.profiles[user_id]=profile # moves the user to the most recently used end
+			self.counters['hits']+=1
+			return profile
+
+	def put(self, user_id, profile):
+		with self.lock:
+			self.profiles.pop(user_id, None)
+			self.profiles[user_id]=profile
+			while len(self.profiles)>self.size:
+				self.profiles.popitem(last=False)
+				self.counters['evictions']+=1
+
+
+class Enricher:
+	"""Builds the CSV rows of decoded tweets, used by the stream listener and the replay.
+	The model (see Models.py) gives the version and the classifier in use with snapshot().
+	With a Deduplicator (see Dedup.py) the tweets seen before are not classified again.
+	With PROFILE_CACHE_SIZE the user columns and their inference are cached by user id.
+	With a prefilter (see Filters.py) only the tweets it keeps are enriched."""
+
+	def __init__(self, model, loads=None, dedup=None, prefilter=None):
+		self.model=model
+		self.loads=loads or Decoder.get_decoder(fields=Decoder.FIELDS+(prefilter.fields if prefilter is not None else ()))
+		self.dedup=dedup
+		self.prefilter=prefilter
+		self.profiles=ProfileCache() if PROFILE_CACHE_SIZE else None
+		self.missing=[0]*len(header)
+		self.lock=threading.Lock()
+
+	def process(self, batch):
+		"""Pipeline worker: decodes a batch of raw tweets and returns their enriched CSV rows,
+		DUPLICATE for the tweets seen before and FILTERED for those not kept by the prefilter"""
+		statuses=[]
+		duplicates=[]
+		filtered=[]
+		for data in batch:
+			try:
+				status=self.decode(data)
+			except Exception as e:
+				metrics.error(e)
+				if PRINT_DEBUG and sampled(): print('Failed: ', str(e))
+				status=None
+			if status is not None and not self.wanted(status):
+				filtered.append(len(statuses))
+				status=None
+			if status is not None and self.duplicate(status):
+				duplicates.append(len(statuses))
+				status=None
+			statuses.append(status)
+		rows=self.enrich_batch(statuses)
+		for index in duplicates: rows[index]=DUPLICATE
+		for index in filtered: rows[index]=FILTERED
+		return rows
+
+	def decode(self, data):
+		"""Decodes a raw tweet"""
+		with metrics.timer('decode'):
+			return self.loads(data)
+
+	def wanted(self, status):
+		"""False for a control message or a tweet dropped by the prefilter"""
+		return self.prefilter is None or self.prefilter.keep(status)
+
+	def duplicate(self, status):
+		"""True when the decoded tweet was seen before"""
+		if self.dedup is not None and isinstance(status, dict) and self.dedup.seen(status.get('id')):
+			metrics.inc('duplicates')
+			return True
+		return False
+
+	def enrich(self, status):
+		"""Builds the CSV row for a decoded tweet"""
+		tweet, meta_text, user_language, profile=self.extract(status)
+		inferred_country_meta=inferred_dimension_meta=None
+		try:
+			version, classifier=self.model.snapshot()
+			if not self.inferred(profile, version):
+				with metrics.timer('classify'):
+					inferred_country_meta, inferred_dimension_meta=classifier.ClassifyTextToCountryDimension(meta_text)
+		except Exception as e:
+			metrics.error(e)
+			if PRINT_DEBUG and sampled(): print e.message
+			inferred_country_meta=inferred_dimension_meta=version=""
+		return self.infer(tweet, user_language, inferred_country_meta, inferred_dimension_meta, version, profile)
+
+	def enrich_batch(self, statuses):
+		"""Builds the CSV rows for a list of decoded tweets with a single classifier call.
+		Tweets which are None or fail to be extracted give None. The decoded tweets are
+		released from the list as soon as they are extracted, before the classification"""
+		extracted=[]
+		for index, status in enumerate(statuses):
+			try:
+				extracted.append(self.extract(status) if status is not None else None)
+			except Exception as e:
+				metrics.error(e)
+				if PRINT_DEBUG and sampled(): print('Failed: ', str(e))
+				extracted.append(None)
+			statuses[index]=None
+		try:
+			version, classifier=self.model.snapshot()
+			# the users with a cached inference are not classified again
+			classified=[item for item in extracted if item is not None and not self.inferred(item[3], version)]
+			meta_texts=[item[1] for item in classified]
+			with metrics.timer('classify', len(meta_texts)):
+				countries, dimensions=classifier.ClassifyBatch(meta_texts)
+		except Exception as e:
+			metrics.error(e)
+			if PRINT_DEBUG and sampled(): print e.message
+			classified=[item for item in extracted if item is not None]
+			countries=dimensions=[""]*len(classified)
+			version=""
+		inferred=dict((id(item), result) for item, result in zip(classified, zip(countries, dimensions)))
+		rows=[]
+		for item in extracted:
+			if item is None:
+				rows.append(None)
+				continue
+			tweet, _, user_language, profile=item
+			inferred_country_meta, inferred_dimension_meta=inferred.get(id(item), (None, None))
+			rows.append(self.infer(tweet, user_language, inferred_country_meta, inferred_dimension_meta, version, profile))
+		return rows
+
+	def extract(self, status):
+		"""Extracts the CSV row, the meta text used for the country inference, the user
+		language and the Profile of the user (None without the profile cache)"""
+		if not isinstance(status, dict): raise ValueError('Not a tweet: %r'%(status,))
+		user=status.get('user')
+		user_id=profile=None
+		if self.profiles is not None and isinstance(user, dict):
+			user_id=user.get('id')
+			if user_id is not None:
+				key=hash(tuple([user.get(field) for field in PROFILE_FIELDS]))
+				profile=self.profiles.get(user_id, key)
+		tweet=[None]*len(header)
+		if profile is None:
+			missing=self.extract_columns(status, tweet, range(len(header)))
+			if user_id is not None:
+				profile=Profile(key, [tweet[column] for column in USER_COLUMNS], [column for column in missing if column in USER_COLUMNS])
+				self.profiles.put(user_id, profile)
+		else:
+			for column, value in zip(USER_COLUMNS, profile.columns): tweet[column]=value
+			missing=profile.missing+self.extract_columns(status, tweet, TWEET_COLUMNS)
+		if missing:
+			with self.lock:
+				for column in missing: self.missing[column]+=1
+
+		user_language=tweet[LANGUAGE_COLUMN]
+		meta_text=user_language+' '+tweet[LANGUAGE_COLUMN+1]+' '+tweet[LANGUAGE_COLUMN+2]
+		return tweet, meta_text, user_language, profile
+
+	def extract_columns(self, status, tweet, columns):
+		"""Sets the columns of the row from the decoded tweet, returns the columns missing in it"""
+		missing=[]
+		for column in columns:
+			get, default, convert=extractors[column]
+			value=get(status) if get is not None else None
+			if value is None:
+				if get is not None: missing.append(column)
+				value=default
+			elif convert is not None:
+				value=convert(value)
+			tweet[column]=value
+		return missing
+
+	def inferred(self, profile, version):
+		"""True when the user was already classified by this version of the model"""
+		return profile is not None and profile.inference is not None and profile.inference[0]==version
+
+	def missing_fields(self):
+		"""Returns the number of tweets without each field"""
+		return dict((header[column], count) for column, count in enumerate(self.missing) if fields[column][1] is not None)
+
+	def infer(self, tweet, user_language, inferred_country_meta, inferred_dimension_meta, version, profile=None):
+		"""Sets the inferred country, dimension, inference strength and model version in the extracted row.
+		The inference of the profile is used when it was made by the same model version, otherwise it is cached"""
+		if self.inferred(profile, version):
+			_, inferred_country_meta, inferred_dimension_meta, strength=profile.inference
+		else:
+			debug=PRINT_DEBUG and sampled()
+			if debug: print "inferred_country_meta=%s, inferred_dimension_meta=%s"%(inferred_country_meta, inferred_dimension_meta)
+
+			with metrics.timer('getDimension'):
+				_,strength,_=getDimension(inferred_country_meta,user_language)
+			if debug: print "Inference strength=%d for inferred_country_meta=%s and user_language=%s"%(strength, inferred_country_meta,user_language)
+			if profile is not None and version: profile.inference=(version, inferred_country_meta, inferred_dimension_meta, strength)
+		tweet[INFERENCE_COLUMN:INFERENCE_COLUMN+3]=[inferred_country_meta, inferred_dimension_meta, strength]
+		tweet[MODEL_VERSION_COLUMN]=version
+		return tweet
@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+#######################################################################
+###   FakeStream.py: Local stream server for testing the collector  ###
+###   Copyright:     Elena Daehnhardt                               ###
+###   Contact me at: edaehn@gmail.com                               ###
+#######################################################################
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Serves the filter stream of Twitter over plain HTTP, following a scenario
+# of what happens on every connection, to try the reconnecting without Twitter:
+#
+#   python FakeStream.py --port 8080 --scenario 503,503,420,drop,stream:1000,stall:100,stream
+#   python save_tweets.py --fake-stream localhost:8080
+#
+# The steps of the scenario, the last one is repeated on further connections:
+#
+#   stream[:N]  sends N tweets (without end by default) and closes the connection
+#   stall:S     accepts the connection and sends nothing for S seconds
+#   drop        closes the connection without a response
+#   420, 503... answers with the HTTP status code
+#
+# The tweets are sent in a chunked HTTP/1.1 body as Twitter does, each one
+# prefixed by its length when the client asks for delimited=length (tweepy).
+# The tweets are read from archives with --archive, or synthetic (see Corpus.py).
+
+import time
+import socket
+import argparse
+import threading
+import BaseHTTPServer
+import SocketServer
+import requests
+from config import *
+import Corpus
+import Reconnect
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+	protocol_version='HTTP/1.1'
+
+	def do_POST(self):
+		body=self.rfile.read(int(self.headers.getheader('content-length') or 0))
+		self.close_connection=1
+		step=self.server.next_step()
+		if step=='drop':
+			return
+		if step.isdigit():
+			message='Error %s\n'%step
+			self.send_response(int(step))
+			self.send_header('Content-Length',str(len(message)))
+			self.end_headers()
+			self.wfile.write(message)
+			return
+		self.send_response(200)
+		self.send_header('Content-Type','application/json; charset=utf-8')
+		self.send_header('Transfer-Encoding','chunked')
+		self.end_headers()
+		self.wfile.flush()
+		kind,_,argument=step.partition(':')
+		if kind=='stall':
+			time.sleep(float(argument))
+			return
+		self.stream(int(argument) if argument else None,'delimited=length' in self.path+'&'+body)
+
+	def stream(self,count,delimited):
+		'''Sends the tweets in chunks, delimited by their length if requested'''
+		server=self.server
+		sent=0
+		started=time.time()
+		try:
+			while (count is None or sent<count) and not server.stopped:
+				data=server.tweets[sent%len(server.tweets)]+'\r\n'
+				if delimited: data='%d\r\n%s'%(len(data),data)
+				self.wfile.write('%x\r\n%s\r\n'%(len(data),data))
+				sent+=1
+				with server.lock: server.sent+=1
+				if server.rate: time.sleep(max(0,started+float(sent)/server.rate-time.time()))
+			self.wfile.write('0\r\n\r\n')
+			self.wfile.flush()
+		except socket.error:
+			pass # the client has disconnected
+
+	def handle(self):
+		try:
+			BaseHTTPServer.BaseHTTPRequestHandler.handle(self)
+		except socket.error:
+			pass # the client has disconnected
+
+	def finish(self):
+		try:
+			BaseHTTPServer.BaseHTTPRequestHandler.finish(self)
+		except socket.error:
+			pass
+
+	def log_message(self,format,*args):
+		if PRINT_DEBUG: BaseHTTPServer.BaseHTTPRequestHandler.log_message(self,format,*args)
+
+
+class FakeStreamServer(SocketServer.ThreadingMixIn,BaseHTTPServer.HTTPServer):
+	'''Stream server following the scenario, a list of steps for the connections
+
+	Inputs:
+	address: (host, port) to listen on, port 0 for any free port
+	scenario: list of steps, see the top of this file
+	tweets: raw tweets to be sent, again from the first after the last
+	rate: tweets per second, 0 for as fast as possible
+	'''
+
+	daemon_threads=True
+	allow_reuse_address=True
+
+	def __init__(self,address,scenario,tweets,rate=0):
+		BaseHTTPServer.HTTPServer.__init__(self,address,_Handler)
+		self.scenario=list(scenario)
+		self.tweets=[data.encode('utf-8') if isinstance(data,unicode) else data for data in tweets]
+		self.rate=rate
+		self.lock=threading.Lock()
+		self.connections=0
+		self.sent=0
+		self.stopped=False
+
+	def next_step(self):
+		with self.lock:
+			step=self.scenario[min(self.connections,len(self.scenario)-1)]
+			self.connections+=1
+		return step
+
+	def start(self):
+		'''Serves in a background thread, returns the server'''
+		thread=threading.Thread(target=self.serve_forever, name='fake-stream')
+		thread.daemon=True
+		thread.start()
+		return self
+
+	def stop(self):
+		'''Stops serving and streaming'''
+		self.stopped=True
+		self.shutdown()
+		self.server_close()
+
+
+class _PlainHTTPAdapter(requests.adapters.HTTPAdapter):
+
+	def send(self,request,**kwargs):
+		request.url='http://'+request.url[len('https://'):]
+		return requests.adapters.HTTPAdapter.send(self,request,**kwargs)
+
+
+class PlainStream(Reconnect.ScheduledStream):
+	'''ScheduledStream connecting to its host over plain HTTP, for a FakeStreamServer'''
+
+	def new_session(self):
+		Reconnect.ScheduledStream.new_session(self)
+		self.session.mount('https://',_PlainHTTPAdapter())
+
+
+if __name__ == '__main__':
+	parser=argparse.ArgumentParser(description='Serves a fake Twitter filter stream over HTTP')
+	parser.add_argument('--port', type=int, default=8080)
+	parser.add_argument('--scenario', default='stream', help='comma-separated steps for the connections')
+	parser.add_argument('--rate', type=float, default=0, help='tweets per second, as fast as possible by default')
+	parser.add_argument('--archive', action='append', default=[], help='JSON archive with the tweets to be sent')
+	parser.add_argument('--tweets', type=int, default=10000, help='number of different tweets')
+	args=parser.parse_args()
+
+	tweets=Corpus.load_corpus(args.archive,args.tweets) if args.archive else Corpus.synthetic_tweets(args.tweets)
+	server=FakeStreamServer(('localhost',args.port),args.scenario.split(','),tweets,args.rate)
+	print "Fake stream on localhost:%d, scenario %s"%(args.port,args.scenario)
+	try:
+		server.serve_forever()
+	except KeyboardInterrupt:
+		print "%d connections, %d tweets sent"%(server.connections,server.sent)
@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+#######################################################################
+###   Filters.py:    Dropping unwanted tweets before enrichment     ###
+###   Copyright:     Elena Daehnhardt                               ###
+###   Contact me at: edaehn@gmail.com                               ###
+#######################################################################
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# The stream sends control messages (limit notices, deletions, warnings...)
+# between the tweets, and tweets which are dropped later anyway. The Filter
+# runs on the decoded tweet before the classifier, so that only the tweets
+# kept are enriched and written:
+#
+#   control messages  routed to their handler and counted, never written
+#   FILTER_LANGUAGES  the tweet languages kept, all with []
+#   FILTER_RETWEETS   True drops the retweets
+#   FILTER_QUOTES     True drops the quote tweets
+#   FILTER_KEYWORDS   True drops the tweets not matching a keyword of the
+#                     stream in their text, hashtags, links or screen name
+#                     as Twitter matches them: case-insensitive whole words,
+#                     all the words of a phrase
+#   SAMPLE_RATE       share of the tweets kept, chosen by a hash of the
+#                     tweet id, so all collectors keep the same tweets
+#
+# The rules are compiled into a list of checks once, the keywords into a
+# single Aho-Corasick automaton finding all of them in one pass over the text.
+
+import sys
+import threading
+from collections import deque
+from config import *
+import Dedup
+from Metrics import metrics
+
+# The top-level fields of the control messages of the stream
+CONTROL=('delete', 'limit', 'scrub_geo', 'status_withheld', 'user_withheld', 'disconnect', 'warning', 'event', 'friends')
+
+def _word(char):
+	return char.isalnum() or char=='_'
+
+
+class AhoCorasick:
+	'''Finds the whole-word occurrences of the keywords in a text, case-insensitive'''
+
+	def __init__(self,keywords):
+		self.keywords=[keyword.lower() for keyword in keywords]
+		self.goto=[{}] # state -> {character: next state}, state 0 is the root
+		self.fail=[0]
+		self.output=[[]] # state -> indexes of the keywords ending there
+		for index,keyword in enumerate(self.keywords):
+			state=0
+			for char in keyword:
+				following=self.goto[state].get(char)
+				if following is None:
+					following=len(self.goto)
+					self.goto[state][char]=following
+					self.goto.append({})
+					self.fail.append(0)
+					self.output.append([])
+				state=following
+			self.output[state].append(index)
+		# the failure links, breadth-first: the state of the longest proper suffix
+		queue=deque(self.goto[0].values())
+		while queue:
+			state=queue.popleft()
+			for char,child in self.goto[state].items():
+				queue.append(child)
+				fallback=self.fail[state]
+				while fallback and char not in self.goto[fallback]: fallback=self.fail[fallback]
+				self.fail[child]=self.goto[fallback].get(char,0)
+				self.output[child]=self.output[child]+self.output[self.fail[child]]
+
+	def search(self,text):
+		'''Returns the set of the indexes of the keywords found in the text'''
+		text=text.lower()
+		goto,fail,output,keywords=self.goto,self.fail,self.output,self.keywords
+		found=set()
+		state=0
+		for end,char in enumerate(text):
+			while state and char not in goto[state]: state=fail[state]
+			state=goto[state].get(char,0)
+			for index in output[state]:
+				start=end-len(keywords[index])+1
+				if (start==0 or not _word(text[start-1])) and (end+1==len(text) or not _word(text[end+1])):
+					found.add(index)
+		return found
+
+
+class KeywordMatcher:
+	'''Tells whether a text matches one of the track phrases: all the words of a phrase'''
+
+	def __init__(self,phrases):
+		words=sorted(set(word for phrase in phrases for word in phrase.lower().split()))
+		self.automaton=AhoCorasick(words)
+		self.phrases=[frozenset(words.index(word) for word in phrase.lower().split()) for phrase in phrases if phrase.split()]
+
+	def matches(self,text):
+		found=self.automaton.search(text)
+		return any(phrase<=found for phrase in self.phrases)
+
+
+def tweet_text(status):
+	'''The parts of a tweet searched for the keywords, with those of its retweeted and quoted tweets'''
+	parts=[]
+	for tweet in (status,status.get('retweeted_status'),status.get('quoted_status')):
+		if not isinstance(tweet,dict): continue
+		parts.append(tweet.get('text') or '')
+		extended=tweet.get('extended_tweet')
+		if isinstance(extended,dict): parts.append(extended.get('full_text') or '')
+		user=tweet.get('user')
+		if isinstance(user,dict): parts.append(user.get('screen_name') or '')
+		entities=tweet.get('entities')
+		if isinstance(entities,dict):
+			parts+=['#'+(hashtag.get('text') or '') for hashtag in entities.get('hashtags') or ()]
+			parts+=[url.get('expanded_url') or '' for url in entities.get('urls') or ()]
+	return '\n'.join(parts)
+
+
+class Filter:
+	'''Decides which decoded tweets are enriched, see the top of this file.
+
+	Inputs:
+	keywords: the track phrases of the stream, checked again with FILTER_KEYWORDS
+	languages, retweets, quotes, keyword_check, sample_rate: the rules, from config.py by default
+	'''
+
+	def __init__(self,keywords=None,languages=FILTER_LANGUAGES,retweets=FILTER_RETWEETS,quotes=FILTER_QUOTES,
+			keyword_check=FILTER_KEYWORDS,sample_rate=SAMPLE_RATE):
+		self.rules=[] # (name, check returning True for a tweet to be dropped)
+		fields=set(CONTROL)
+		if languages:
+			allowed=frozenset(languages)
+			self.rules.append(('language',lambda status: status.get('lang') not in allowed))
+			fields.add('lang')
+		if retweets:
+			self.rules.append(('retweet',lambda status: 'retweeted_status' in status))
+			fields.add('retweeted_status')
+		if quotes:
+			self.rules.append(('quote',lambda status: bool(status.get('is_quote_status'))))
+			fields.add('is_quote_status')
+		if keyword_check and keywords:
+			matcher=KeywordMatcher(keywords)
+			self.rules.append(('keyword',lambda status: not matcher.matches(tweet_text(status))))
+			fields.update(('extended_tweet','retweeted_status','quoted_status'))
+		if sample_rate<1:
+			threshold=int(sample_rate*(1<<64))
+			self.rules.append(('sample',lambda status: Dedup._mix(int(status.get('id') or 0))>=threshold))
+		self.fields=tuple(sorted(fields)) # the fields the decoder has to keep for the rules
+		self.handlers={'limit':self.on_limit, 'disconnect':self.on_disconnect, 'warning':self.on_warning}
+		self.lock=threading.Lock()
+		self.counters={'kept':0, 'limited':0}
+
+	def keep(self,status):
+		'''Returns True for a tweet to be enriched, False for a control message or a dropped tweet'''
+		if not isinstance(status,dict): return True # fails in the enrichment, as before
+		if 'id' not in status:
+			kind=next((field for field in CONTROL if field in status),None)
+			if kind is not None:
+				self.route(kind,status[kind])
+				return False
+		for name,check in self.rules:
+			if check(status):
+				self.count(name)
+				metrics.inc('filtered',label=name)
+				return False
+		self.count('kept')
+		return True
+
+	def route(self,kind,message):
+		self.count(kind)
+		metrics.inc('control',label=kind)
+		handler=self.handlers.get(kind)
+		if handler is not None: handler(message)
+
+	def count(self,name,count=1):
+		with self.lock: self.counters[name]=self.counters.get(name,0)+count
+
+	def on_limit(self,message):
+		# track is the number of tweets not delivered since the connection
+		if isinstance(message,dict) and isinstance(message.get('track'),(int,long)):
+			with self.lock: self.counters['limited']=max(self.counters['limited'],message['track'])
+
+	def on_disconnect(self,message):
+		print >>sys.stderr, "Disconnect message from the stream: %s"%(message,)
+
+	def on_warning(self,message):
+		print >>sys.stderr, "Warning from the stream: %s"%(message,)
@@ -0,0 +1,228 @@
+# -*- coding: utf-8 -*-
+#######################################################################
+###   Metrics.py:    Throughput and latency of the collector        ###
+###   Copyright:     Elena Daehnhardt                               ###
+###   Contact me at: edaehn@gmail.com                               ###
+#######################################################################
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# The collector counts its tweets and errors and times its stages into
+# Metrics.metrics: counters (with an optional label, as the error type),
+# latency histograms and gauges read when reported. Every METRICS_INTERVAL
+# seconds a stats line with the rates and latencies is printed, and with
+# METRICS_PORT the metrics are served in the Prometheus text format on
+# http://localhost:METRICS_PORT/metrics (or the port given by --metrics-port
+# to save_tweets.py), unless the port is already in use.
+#
+# The details of single tweets printed with PRINT_DEBUG=True are sampled,
+# one tweet in PRINT_DEBUG_SAMPLE, see sampled().
+
+import sys
+import time
+import socket
+import bisect
+import threading
+import itertools
+import BaseHTTPServer
+from config import *
+
+# Upper bounds of the latency buckets in seconds, from 10 microseconds to 10 seconds
+BUCKETS=[b*10**e for e in range(-5,1) for b in (1,2.5,5)]+[10]
+
+class Histogram:
+	'''Counts of latencies in the BUCKETS, with their sum'''
+
+	def __init__(self):
+		self.counts=[0]*(len(BUCKETS)+1) # the last one for latencies above the buckets
+		self.count=0
+		self.sum=0.0
+
+	def observe(self,seconds,count=1):
+		self.counts[bisect.bisect_left(BUCKETS,seconds)]+=count
+		self.count+=count
+		self.sum+=seconds*count
+
+	def quantile(self,q):
+		'''Upper bound of the bucket holding the q quantile'''
+		if not self.count: return 0.0
+		rank=q*self.count
+		total=0
+		for bound,count in zip(BUCKETS+[float('inf')],self.counts):
+			total+=count
+			if total>=rank: return bound
+		return float('inf')
+
+
+class _Timer:
+
+	def __init__(self,metrics,name,count):
+		self.metrics=metrics
+		self.name=name
+		self.count=count
+
+	def __enter__(self):
+		self.started=time.time()
+
+	def __exit__(self,*exc_info):
+		if self.count: self.metrics.observe(self.name,(time.time()-self.started)/self.count,self.count)
+
+
+class Metrics:
+	'''Counters, latency histograms and gauges of the collector'''
+
+	def __init__(self,prefix='save_tweets'):
+		self.prefix=prefix
+		self.lock=threading.Lock()
+		self.counters={} # (name, label) -> count
+		self.histograms={} # name -> Histogram
+		self.gauges={} # name -> function returning the value
+		self.started=time.time()
+		self.last_report=(time.time(),{})
+
+	def inc(self,name,count=1,label=None):
+		with self.lock:
+			key=(name,label)
+			self.counters[key]=self.counters.get(key,0)+count
+
+	def error(self,e):
+		'''Counts an exception by its type'''
+		self.inc('errors',label=type(e).__name__)
+
+	def observe(self,name,seconds,count=1):
+		'''Adds the latency of count items which took seconds each'''
+		with self.lock:
+			histogram=self.histograms.get(name)
+			if histogram is None: histogram=self.histograms[name]=Histogram()
+			histogram.observe(seconds,count)
+
+	def timer(self,name,count=1):
+		'''with metrics.timer('write'): ... observes the time spent in the block, divided by count'''
+		return _Timer(self,name,count)
+
+	def gauge(self,name,function):
+		'''Registers a function giving the current value of name, None when unknown'''
+		self.gauges[name]=function
+
+	def total(self,name):
+		with self.lock:
+			return sum(count for (counter,_),count in self.counters.items() if counter==name)
+
+	def _gauge_values(self):
+		values={}
+		for name,function in self.gauges.items():
+			try:
+				value=function()
+			except Exception:
+				value=None
+			if value is not None: values[name]=value
+		return values
+
+	def stats_line(self):
+		'''Rates since the previous stats line, latencies and gauges in one line'''
+		now=time.time()
+		with self.lock:
+			totals={}
+			for (name,_),count in self.counters.items(): totals[name]=totals.get(name,0)+count
+			latencies=[(name,histogram.quantile(0.5),histogram.quantile(0.99)) for name,histogram in sorted(self.histograms.items())]
+		last_time,last_totals=self.last_report
+		self.last_report=(now,totals)
+		elapsed=max(now-last_time,1e-6)
+		parts=['%s %.1f/s'%(name,(totals[name]-last_totals.get(name,0))/elapsed) for name in sorted(totals) if name!='errors']
+		parts.append('errors %d'%totals.get('errors',0))
+		parts+=['%s p50 %s p99 %s'%(name,_ms(p50),_ms(p99)) for name,p50,p99 in latencies]
+		parts+=['%s %s'%(name,_value(name,value)) for name,value in sorted(self._gauge_values().items())]
+		return 'Stats: '+', '.join(parts)
+
+	def prometheus(self):
+		'''The metrics in the Prometheus text exposition format'''
+		lines=[]
+		with self.lock:
+			for (name,label),count in sorted(self.counters.items()):
+				metric='%s_%s_total'%(self.prefix,name)
+				if label is None or not lines or not lines[-1].startswith(metric):
+					lines.append('# TYPE %s counter'%metric)
+				labels='{type="%s"}'%label if label is not None else ''
+				lines.append('%s%s %d'%(metric,labels,count))
+			for name,histogram in sorted(self.histograms.items()):
+				metric='%s_%s_seconds'%(self.prefix,name)
+				lines.append('# TYPE %s histogram'%metric)
+				total=0
+				for bound,count in zip(BUCKETS,histogram.counts):
+					total+=count
+					lines.append('%s_bucket{le="%g"} %d'%(metric,bound,total))
+				lines.append('%s_bucket{le="+Inf"} %d'%(metric,histogram.count))
+				lines.append('%s_sum %f'%(metric,histogram.sum))
+				lines.append('%s_count %d'%(metric,histogram.count))
+		for name,value in sorted(self._gauge_values().items()):
+			lines.append('# TYPE %s_%s gauge'%(self.prefix,name))
+			lines.append('%s_%s %s'%(self.prefix,name,float(value)))
+		lines.append('%s_uptime_seconds %f'%(self.prefix,time.time()-self.started))
+		return '\n'.join(lines)+'\n'
+
+	def start(self,interval=METRICS_INTERVAL,port=METRICS_PORT):
+		'''Prints the stats line every interval seconds and serves the metrics on the port, if not 0'''
+		if interval:
+			thread=threading.Thread(target=self._report, args=(interval,), name='metrics')
+			thread.daemon=True
+			thread.start()
+		if port:
+			try:
+				server=BaseHTTPServer.HTTPServer(('localhost',port),_handler(self))
+			except socket.error as e:
+				# as another collector on the same port, collect without the endpoint
+				print >>sys.stderr, "Metrics are not served on port %d: %s"%(port,e)
+				self.error(e)
+				return self
+			thread=threading.Thread(target=server.serve_forever, name='metrics-server')
+			thread.daemon=True
+			thread.start()
+		return self
+
+	def _report(self,interval):
+		while True:
+			time.sleep(interval)
+			print self.stats_line()
+			sys.stdout.flush()
+
+
+def _handler(metrics):
+	class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+		def do_GET(self):
+			if self.path.split('?')[0] not in ('/','/metrics'):
+				self.send_error(404)
+				return
+			body=metrics.prometheus()
+			self.send_response(200)
+			self.send_header('Content-Type','text/plain; version=0.0.4')
+			self.send_header('Content-Length',str(len(body)))
+			self.end_headers()
+			self.wfile.write(body)
+
+		def log_message(self,format,*args):
+			pass
+	return Handler
+
+def _ms(seconds):
+	return '>10s' if seconds==float('inf') else '%gms'%(seconds*1000)
+
+def _value(name,value):
+	if name.endswith('_rate'): return '%.1f%%'%(value*100)
+	return '%.1f'%value if isinstance(value,float) else str(value)
+
+_sample=itertools.count()
+
+def sampled():
+	'''True for one call in PRINT_DEBUG_SAMPLE, for printing the details of some tweets only'''
+	return next(_sample)%PRINT_DEBUG_SAMPLE==0
+
+metrics=Metrics()
@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+#######################################################################
+###   Models.py:     Finding and loading the classification models  ###
+###   Copyright:     Elena Daehnhardt                               ###
+###   Contact me at: edaehn@gmail.com                               ###
+#######################################################################
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import sys
+import time
+import threading
+from config import *
+import Classifier
+
+basedir = os.path.abspath(os.path.dirname(__file__))
+models_dir = os.path.join(basedir, 'models/')
+
+class ModelLoadError(Exception):
+	pass
+
+def latest_model(models_dir=models_dir):
+	'''Returns the name of the most recently modified model directory in models_dir'''
+	if not os.path.isdir(models_dir): raise ModelLoadError('No models directory %s'%models_dir)
+	models_subdirs=[models_dir+s for s in os.listdir(models_dir) if os.path.isdir(models_dir+s)]
+	if not models_subdirs: raise ModelLoadError('No models in %s'%models_dir)
+	MODEL=max(models_subdirs, key=os.path.getmtime)
+	return MODEL.rsplit('/', 1)[-1]
+
+def load_model(model,models_dir=models_dir,mmap_mode=MODEL_MMAP_MODE):
+	'''Loads the META classifier of the model, wrapped into the classifier cache when enabled.
+	With mmap_mode='r' the numpy arrays of the model are memory-mapped from the file, so
+	several collector processes share one copy (only for models saved without compression).
+
+	Raises ModelLoadError when the model cannot be loaded.
+	'''
+	try:
+		import joblib
+	except ImportError:
+		from sklearn.externals import joblib
+	filename=os.path.join(models_dir,model,'META')
+	try:
+		c2 = joblib.load(filename, mmap_mode=mmap_mode)
+	except Exception as e:
+		raise ModelLoadError('Cannot load the model %s: %s'%(filename,e))
+	if not hasattr(c2,'classifier') or not hasattr(c2,'labels'):
+		raise ModelLoadError('The model %s is not a trained Classifier'%filename)
+	if CLASSIFIER_CACHE_SIZE:
+		c2=Classifier.CachedClassifier(c2)
+	return c2
+
+
+class StaticModel:
+	'''A loaded model which does not change, snapshot() gives its version and classifier'''
+
+	def __init__(self,version,classifier):
+		self.current=(version,classifier)
+
+	def snapshot(self):
+		return self.current
+
+
+class LazyModel:
+	'''Loads the model (the newest one when model is None) in a background thread,
+	so that the stream can connect meanwhile. snapshot() waits until the model is
+	loaded and returns its version and classifier, or raises ModelLoadError.
+
+	With watch_interval>0 the thread then checks models_dir every watch_interval
+	seconds and loads a newer model directory. The new model replaces the current
+	one with a single assignment, so the tweets are classified by the old model
+	until the new one is completely loaded.'''
+
+	def __init__(self,model=None,models_dir=models_dir,watch_interval=MODEL_WATCH_INTERVAL):
+		self.model=model
+		self.models_dir=models_dir
+		self.watch_interval=watch_interval
+		self.current=None # (version, classifier)
+		self.error=None
+		self.failed=None # (model, META modification time) which failed to load while watching
+		self.loaded=threading.Event()
+		thread=threading.Thread(target=self._run, name='model-loader')
+		thread.daemon=True
+		thread.start()
+
+	def _load(self,model):
+		started=time.time()
+		classifier=load_model(model,self.models_dir)
+		self.current=(model,classifier)
+		if self.loaded.is_set():
+			print "Model %s loaded in %.3fs, it replaces the previous model"%(model,time.time()-started)
+		else:
+			print "Startup: model %s loaded in %.3fs"%(model,time.time()-started)
+
+	def _watch(self):
+		model=latest_model(self.models_dir)
+		if self.current is not None and model==self.current[0]: return
+		filename=os.path.join(self.models_dir,model,'META')
+		if not os.path.isfile(filename): return
+		# a model which is still being copied fails to load, it is tried again when META changes
+		attempt=(model,os.path.getmtime(filename))
+		if attempt==self.failed: return
+		try:
+			self._load(model)
+		except ModelLoadError:
+			self.failed=attempt
+			raise
+
+	def _run(self):
+		try:
+			self._load(self.model or latest_model(self.models_dir))
+		except ModelLoadError as e:
+			self.error=e
+			print >>sys.stderr, "ERROR: %s, the tweets are saved without country inference"%e
+		finally:
+			self.loaded.set()
+		while self.watch_interval:
+			time.sleep(self.watch_interval)
+			try:
+				self._watch()
+			except (ModelLoadError,OSError) as e:
+				print >>sys.stderr, "ERROR: %s, keeping the current model"%e
+
+	def snapshot(self):
+		# Event.wait() without a timeout would block Ctrl+C in Python 2
+		while not self.loaded.wait(1): pass
+		current=self.current
+		if current is None: raise self.error
+		return current
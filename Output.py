@@ -0,0 +1,442 @@
+# -*- coding: utf-8 -*-
+#######################################################################
+###   Output.py:     Buffered output sinks for Save Tweets          ###
+###   Copyright:     Elena Daehnhardt                               ###
+###   Contact me at: edaehn@gmail.com                               ###
+#######################################################################
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import csv
+import gzip
+import time
+import glob
+import Queue
+import shutil
+import sqlite3
+import weakref
+import threading
+from datetime import date, datetime, timedelta
+from config import *
+
+# Output sinks keep their file open for the lifetime of the collector and
+# write the buffered rows in batches: when FLUSH_ROWS rows are waiting or
+# when FLUSH_INTERVAL seconds have passed since the last flush. The flusher
+# thread checks the sinks every second, so the rows are also written when
+# no more tweets arrive.
+# close() flushes and fsyncs, so it is safe to call from signal_handler.
+
+_sinks=None
+_sinks_lock=threading.Lock()
+
+def _register(sink):
+	'''Adds the sink to the ones checked by the flusher thread'''
+	global _sinks
+	with _sinks_lock:
+		if _sinks is None:
+			_sinks=weakref.WeakSet()
+			thread=threading.Thread(target=_flush_waiting, name='output-flusher')
+			thread.daemon=True
+			thread.start()
+		_sinks.add(sink)
+
+def _flush_waiting():
+	while True:
+		time.sleep(1)
+		with _sinks_lock:
+			sinks=list(_sinks)
+		for sink in sinks:
+			try:
+				sink.flush_waiting()
+			except Exception as e:
+				print "ERROR: flushing %s failed: %s"%(sink.filename,e)
+		del sinks
+
+
+class BufferedSink:
+
+	def __init__(self,filename,header=None,flush_rows=FLUSH_ROWS,flush_interval=FLUSH_INTERVAL):
+		self.flush_rows=flush_rows
+		self.flush_interval=flush_interval
+		self.rows=[]
+		self.rows_written=0
+		# RLock: signal_handler may interrupt the main thread inside write()
+		self.lock=threading.RLock()
+		self.f=None
+		self.open(filename,header)
+		if flush_interval<float('inf'): _register(self)
+
+	def open(self,filename,header=None):
+		'''Opens filename for appending, writes the header into a new file'''
+		new_file=not os.path.isfile(filename)
+		self.filename=filename
+		self.f=open(filename,'ab')
+		self.last_flush=time.time()
+		if header and new_file:
+			self.write_rows([header])
+			self.f.flush()
+
+	def reopen(self,filename,header=None):
+		'''Flushes and closes the current file and continues in filename'''
+		with self.lock:
+			self.close()
+			self.open(filename,header)
+
+	def write(self,row):
+		with self.lock:
+			self.rows.append(row)
+			if len(self.rows)>=self.flush_rows or time.time()-self.last_flush>=self.flush_interval:
+				self.flush()
+
+	def flush_waiting(self):
+		'''Flushes the buffered rows once flush_interval seconds have passed since the last flush'''
+		with self.lock:
+			if self.rows and time.time()-self.last_flush>=self.flush_interval: self.flush()
+
+	def flush(self,sync=False):
+		'''Writes all buffered rows; with sync=True also fsyncs the file'''
+		with self.lock:
+			if self.f is None: return
+			rows,self.rows=self.rows,[]
+			if rows:
+				self.write_rows(rows)
+				self.rows_written+=len(rows)
+			self.f.flush()
+			if sync: os.fsync(self.f.fileno())
+			self.last_flush=time.time()
+
+	def close(self):
+		with self.lock:
+			if self.f is None: return
+			self.flush(sync=True)
+			self.f.close()
+			self.f=None
+
+	def size(self):
+		'''Size of the file including the flushed rows'''
+		with self.lock:
+			return os.fstat(self.f.fileno()).st_size if self.f is not None else 0
+
+	def write_rows(self,rows):
+		raise NotImplementedError
+
+
+class CSVSink(BufferedSink):
+
+	def write_rows(self,rows):
+		csv.writer(self.f, dialect='excel').writerows(rows)
+
+
+
+class ParquetSink(BufferedSink):
+	'''Writes the rows into a Parquet file, one row group per flush, with the
+	column types of column_types ('datetime', 'int', 'float', 'category' or
+	'string'). The category columns are dictionary-encoded. Parquet files cannot
+	be appended to, so an existing file gets a new name with a number.
+	Needs the pyarrow package.'''
+
+	def __init__(self,filename,header,column_types,flush_rows=PARQUET_ROW_GROUP,flush_interval=float('inf')):
+		try:
+			import pyarrow
+			import pyarrow.parquet
+		except ImportError:
+			raise ImportError('SAFE_PARQUET=True needs the pyarrow package: pip install pyarrow')
+		self.pa=pyarrow
+		self.pq=pyarrow.parquet
+		types={'datetime':pyarrow.timestamp('s'), 'int':pyarrow.int64(), 'float':pyarrow.float64(),
+			'category':pyarrow.string(), 'string':pyarrow.string()}
+		self.header=header
+		self.column_types=column_types
+		self.schema=pyarrow.schema([pyarrow.field(name,types[column_type]) for name,column_type in zip(header,column_types)])
+		self.dictionary=[name for name,column_type in zip(header,column_types) if column_type=='category']
+		# the rows are buffered by column, so that the row lists are freed as soon as they are written
+		self.columns=[[] for _ in header]
+		self.buffered=0
+		BufferedSink.__init__(self,filename,flush_rows=flush_rows,flush_interval=flush_interval)
+
+	def open(self,filename,header=None):
+		base,extension=os.path.splitext(filename)
+		number=0
+		while os.path.exists(filename):
+			number+=1
+			filename='%s.%d%s'%(base,number,extension)
+		self.filename=filename
+		self.f=self.pq.ParquetWriter(filename,self.schema,use_dictionary=self.dictionary,compression='snappy')
+		self.last_flush=time.time()
+
+	def convert(self,values,column_type):
+		if column_type=='datetime':
+			return [datetime.strptime(value,'%Y-%m-%d %H:%M:%S') if value else None for value in values]
+		if column_type=='int':
+			return [int(value) if value!='' else None for value in values]
+		if column_type=='float':
+			return [float(value) if value!='' else None for value in values]
+		return [value if value!='' else None for value in values]
+
+	def write(self,row):
+		with self.lock:
+			columns=self.columns
+			for column,value in enumerate(row): columns[column].append(value)
+			self.buffered+=1
+			if self.buffered>=self.flush_rows or time.time()-self.last_flush>=self.flush_interval:
+				self.flush()
+
+	def flush_waiting(self):
+		with self.lock:
+			if self.buffered and time.time()-self.last_flush>=self.flush_interval: self.flush()
+
+	def write_rows(self,rows):
+		self.write_columns(map(list,zip(*rows)))
+
+	def write_columns(self,columns):
+		arrays=[]
+		for column_type,field in zip(self.column_types,self.schema):
+			# every column is freed once converted, not at the end of the row group
+			arrays.append(self.pa.array(self.convert(columns.pop(0),column_type),type=field.type))
+		self.f.write_table(self.pa.Table.from_arrays(arrays,schema=self.schema))
+
+	def flush(self,sync=False):
+		# a Parquet file is only complete when it is closed, sync has no effect
+		with self.lock:
+			if self.f is None: return
+			if self.buffered:
+				columns,self.columns=self.columns,[[] for _ in self.header]
+				self.write_columns(columns)
+				self.rows_written+=self.buffered
+				self.buffered=0
+			self.last_flush=time.time()
+
+	def size(self):
+		return os.path.getsize(self.filename)
+
+	def close(self):
+		with self.lock:
+			if self.f is None: return
+			self.flush()
+			self.f.close()
+			self.f=None
+
+
+class SQLiteSink(BufferedSink):
+	"""Inserts the rows into the table tweets of a SQLite database in WAL mode,
+	with one transaction per flush, so readers can query it while collecting.
+	The columns are named after the header in lower case (created_at, user_id,
+	inferred_country...) and typed by column_types. The space-joined columns
+	in normalized (the hashtags and user mentions) go into a table of their own
+	each instead, one row per value with the id of the tweet."""
+
+	TYPES={'datetime':'TEXT', 'int':'INTEGER', 'float':'REAL', 'category':'TEXT', 'string':'TEXT'}
+	INDEXED=['Created At', 'Inferred Country', 'User Id']
+
+	def __init__(self,filename,header,column_types,normalized=(('Hashtags','hashtags','hashtag'),('User Mentions','mentions','screen_name')),
+			flush_rows=FLUSH_ROWS,flush_interval=FLUSH_INTERVAL):
+		self.column_types=column_types
+		self.normalized=[(header.index(column),table,name) for column,table,name in normalized]
+		skipped=set(position for position,_,_ in self.normalized)
+		self.kept=[position for position in range(len(header)) if position not in skipped]
+		self.columns=[column_name(name) for name in header]
+		self.indexed=[column_name(name) for name in self.INDEXED if name in header]
+		BufferedSink.__init__(self,filename,flush_rows=flush_rows,flush_interval=flush_interval)
+
+	def open(self,filename,header=None):
+		self.filename=filename
+		# the pipeline writer inserts, signal_handler closes from the main thread
+		self.f=sqlite3.connect(filename,check_same_thread=False,isolation_level=None)
+		self.f.execute('PRAGMA journal_mode=WAL')
+		self.f.execute('PRAGMA synchronous=NORMAL')
+		self.f.execute('CREATE TABLE IF NOT EXISTS tweets (id INTEGER PRIMARY KEY, %s)'%', '.join(
+			'%s %s'%(self.columns[position],self.TYPES[self.column_types[position]]) for position in self.kept))
+		for column in self.indexed:
+			self.f.execute('CREATE INDEX IF NOT EXISTS tweets_%s ON tweets (%s)'%(column,column))
+		for _,table,name in self.normalized:
+			self.f.execute('CREATE TABLE IF NOT EXISTS %s (tweet INTEGER REFERENCES tweets (id), %s TEXT)'%(table,name))
+			self.f.execute('CREATE INDEX IF NOT EXISTS %s_%s ON %s (%s)'%(table,name,table,name))
+			self.f.execute('CREATE INDEX IF NOT EXISTS %s_tweet ON %s (tweet)'%(table,table))
+		self.insert='INSERT INTO tweets (id, %s) VALUES (?%s)'%(', '.join(self.columns[position] for position in self.kept),', ?'*len(self.kept))
+		self.last_flush=time.time()
+
+	def convert(self,value,column_type):
+		if value=='' and column_type in ('datetime','int','float'): return None
+		if isinstance(value,str): return value.decode('utf-8','replace')
+		return value
+
+	def write_rows(self,rows):
+		kept=[(position,self.column_types[position]) for position in self.kept]
+		cursor=self.f.cursor()
+		cursor.execute('BEGIN IMMEDIATE')
+		try:
+			# the ids are given here, so that the hashtags and mentions can refer to them
+			first=cursor.execute('SELECT COALESCE(MAX(id), 0)+1 FROM tweets').fetchone()[0]
+			cursor.executemany(self.insert,[[first+number]+[self.convert(row[position],column_type) for position,column_type in kept]
+				for number,row in enumerate(rows)])
+			for position,table,name in self.normalized:
+				cursor.executemany('INSERT INTO %s (tweet, %s) VALUES (?, ?)'%(table,name),
+					[(first+number,self.convert(value,'string')) for number,row in enumerate(rows) for value in str(row[position]).split()])
+			cursor.execute('COMMIT')
+		except:
+			cursor.execute('ROLLBACK')
+			raise
+
+	def flush(self,sync=False):
+		# every batch is committed by write_rows()
+		with self.lock:
+			if self.f is None: return
+			rows,self.rows=self.rows,[]
+			if rows:
+				self.write_rows(rows)
+				self.rows_written+=len(rows)
+			self.last_flush=time.time()
+
+	def size(self):
+		return os.path.getsize(self.filename)
+
+	def close(self):
+		with self.lock:
+			if self.f is None: return
+			self.flush()
+			self.f.close()
+			self.f=None
+
+def column_name(name):
+	"""SQL name of a column: 'Inferred Country' is inferred_country"""
+	return '_'.join(name.lower().split())
+
+
+# The rotating outputs start a new file every day and when a file has grown
+# over ROTATE_MB, named twitter_YYYY-MM-DD.csv, twitter_YYYY-MM-DD_1.csv and
+# so on. The closed files are compressed and the old files removed in a
+# background thread, so the stream never waits for them.
+
+_tasks=None
+
+def background(task,*args):
+	"""Runs task(*args) in the background thread, one task after another"""
+	global _tasks
+	if _tasks is None:
+		_tasks=Queue.Queue()
+		thread=threading.Thread(target=_run_tasks, name='output-background')
+		thread.daemon=True
+		thread.start()
+	_tasks.put((task,args))
+
+def _run_tasks():
+	while True:
+		task,args=_tasks.get()
+		try:
+			task(*args)
+		except Exception as e:
+			print "ERROR: %s%r failed: %s"%(task.__name__,args,e)
+
+def gzip_file(filename):
+	"""Compresses a closed file into filename.gz and removes it"""
+	tmp=filename+'.gz.tmp'
+	with open(filename,'rb') as f:
+		with open(tmp,'wb') as raw:
+			with gzip.GzipFile(os.path.basename(filename),'wb',fileobj=raw) as out:
+				shutil.copyfileobj(f,out,1<<20)
+			raw.flush()
+			os.fsync(raw.fileno())
+	os.rename(tmp,filename+'.gz')
+	os.remove(filename)
+
+
+class RotatingSink:
+	"""Writes through a sink of make_sink(filename) into a new file every day
+	and when the file has grown over max_bytes. The file name is computed once
+	per file, the sink writes the header into every new file. The closed files
+	are compressed with compress(filename) (None for not compressing), the
+	files of more than retention_days days ago are removed (0 for never).
+	"""
+
+	def __init__(self,directory,extension,make_sink,prefix='twitter_',
+			max_bytes=ROTATE_MB*1024*1024,compress=None,retention_days=RETENTION_DAYS):
+		self.directory=directory
+		self.extension=extension
+		self.make_sink=make_sink
+		self.prefix=prefix
+		self.max_bytes=max_bytes
+		self.compress=compress
+		self.retention_days=retention_days
+		self.lock=threading.RLock()
+		self.sink=None
+		self.day=None
+		self.open()
+		# the files closed by an earlier run
+		for filename in self.files():
+			if compress is not None and filename!=self.filename and filename.endswith(extension): background(compress,filename)
+		if retention_days: background(self.prune)
+
+	def path(self,day,part):
+		return '%s%s%s%s%s'%(self.directory,self.prefix,day,'_%d'%part if part else '',self.extension)
+
+	def files(self):
+		"""The files of this output, except the ones being compressed"""
+		return [filename for filename in sorted(glob.glob(self.directory+self.prefix+'*'))
+			if not filename.endswith('.tmp') and not filename.endswith('.idx')]
+
+	def open(self):
+		today=date.today()
+		day=today.strftime("%Y-%m-%d")
+		if day==self.day:
+			self.part+=1
+		else:
+			# continue in the last file of the day, unless it was already compressed
+			self.day=day
+			self.part=0
+			while os.path.exists(self.path(day,self.part+1)) or os.path.exists(self.path(day,self.part+1)+'.gz'): self.part+=1
+			if os.path.exists(self.path(day,self.part)+'.gz'): self.part+=1
+		self.sink=self.make_sink(self.path(day,self.part))
+		self.checked=self.sink.rows_written
+		self.next_day=time.mktime((today+timedelta(days=1)).timetuple())
+
+	def rotate(self):
+		"""Closes the current file and continues in a new one"""
+		with self.lock:
+			self.sink.close()
+			closed=self.sink.filename
+			self.open()
+			if self.compress is not None: background(self.compress,closed)
+			if self.retention_days: background(self.prune)
+
+	def prune(self):
+		"""Removes the files of more than retention_days days ago"""
+		oldest=(date.today()-timedelta(days=self.retention_days)).strftime("%Y-%m-%d")
+		for filename in self.files():
+			if os.path.basename(filename)[len(self.prefix):len(self.prefix)+10]<oldest:
+				os.remove(filename)
+				if os.path.exists(filename+'.idx'): os.remove(filename+'.idx')
+
+	@property
+	def filename(self):
+		return self.sink.filename
+
+	@property
+	def rows_written(self):
+		return self.sink.rows_written
+
+	def write(self,row):
+		with self.lock:
+			if time.time()>=self.next_day: self.rotate()
+			self.sink.write(row)
+			# the size only changes when the sink has flushed
+			if self.max_bytes and self.sink.rows_written!=self.checked:
+				self.checked=self.sink.rows_written
+				if self.sink.size()>=self.max_bytes: self.rotate()
+
+	def flush(self,sync=False):
+		with self.lock:
+			self.sink.flush(sync)
+
+	def close(self):
+		with self.lock:
+			self.sink.close()
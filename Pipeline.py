@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+#######################################################################
+###   Pipeline.py:   Queue and worker pool for the tweet processing ###
+###   Copyright:     Elena Daehnhardt                               ###
+###   Contact me at: edaehn@gmail.com                               ###
+#######################################################################
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import Queue
+import heapq
+import threading
+import time
+from config import *
+
+# The stream thread only submits the raw tweets into a bounded queue.
+# Worker threads take them in batches of up to batch_size tweets, waiting at
+# most batch_wait seconds for a batch to fill, and call process(batch), which
+# returns one result per tweet (None when it failed). The results go to a
+# single writer thread, which calls write(data, result) in the order the
+# tweets were submitted. A batch for which process fails, or returns another
+# number of results, is written with None for every tweet.
+
+_STOP=object()
+
+class Pipeline:
+
+	def __init__(self,process,write,workers=PIPELINE_WORKERS,queue_size=PIPELINE_QUEUE_SIZE,
+			block=PIPELINE_BLOCK,put_timeout=PIPELINE_PUT_TIMEOUT,
+			batch_size=PIPELINE_BATCH_SIZE,batch_wait=PIPELINE_BATCH_WAIT):
+		self.process=process
+		self.write=write
+		self.batch_size=batch_size
+		self.batch_wait=batch_wait
+		self.block=block
+		self.put_timeout=put_timeout
+		self.queue=Queue.Queue(queue_size)
+		self.results=Queue.Queue(queue_size)
+		self.workers=[threading.Thread(target=self._work, name='pipeline-worker-%d'%i) for i in range(workers)]
+		self.writer=threading.Thread(target=self._write, name='pipeline-writer')
+		self.sequence=0
+		self.closed=False
+		self.lock=threading.Lock()
+		self.counters={'received':0, 'overflows':0, 'dropped':0, 'failed':0, 'written':0, 'write_errors':0}
+
+	def start(self):
+		for thread in self.workers+[self.writer]:
+			thread.daemon=True
+			thread.start()
+		return self
+
+	def submit(self,data):
+		'''Queues a raw tweet, returns False when it was dropped'''
+		if self.closed: return False
+		self.counters['received']+=1
+		item=(self.sequence,data)
+		try:
+			self.queue.put_nowait(item)
+		except Queue.Full:
+			self.counters['overflows']+=1
+			try:
+				if not self.block: raise Queue.Full
+				self.queue.put(item, True, self.put_timeout)
+			except Queue.Full:
+				self.counters['dropped']+=1
+				return False
+		self.sequence+=1
+		return True
+
+	def close(self):
+		'''Stops accepting tweets and waits until everything queued is written'''
+		if self.closed: return
+		self.closed=True
+		for _ in self.workers: self.queue.put(_STOP)
+		for thread in self.workers: thread.join()
+		self.results.put(_STOP)
+		self.writer.join()
+
+	def qsize(self):
+		return self.queue.qsize()
+
+	def _next_batch(self):
+		'''Returns the next batch of (sequence, data) items and whether to stop'''
+		item=self.queue.get()
+		if item is _STOP: return [],True
+		batch=[item]
+		deadline=time.time()+self.batch_wait
+		while len(batch)<self.batch_size:
+			timeout=deadline-time.time()
+			try:
+				item=self.queue.get(timeout>0, max(timeout,0))
+			except Queue.Empty:
+				break
+			if item is _STOP: return batch,True
+			batch.append(item)
+		return batch,False
+
+	def _work(self):
+		stop=False
+		while not stop:
+			batch,stop=self._next_batch()
+			if not batch: continue
+			try:
+				results=self.process([data for _,data in batch])
+				# the writer waits for every sequence number, a missing result would stop it for good
+				if len(results)!=len(batch):
+					raise ValueError('%d results for a batch of %d tweets'%(len(results),len(batch)))
+			except Exception as e:
+				if PRINT_DEBUG: print('Failed: ', str(e))
+				results=[None]*len(batch)
+			failed=sum(1 for result in results if result is None)
+			if failed:
+				with self.lock: self.counters['failed']+=failed
+			for (sequence,data),result in zip(batch,results):
+				self.results.put((sequence,data,result))
+
+	def _write(self):
+		# results arrive out of order from the workers, keep them in a heap
+		# until the next expected sequence number is available
+		pending=[]
+		expected=0
+		while True:
+			item=self.results.get()
+			if item is not _STOP: heapq.heappush(pending,item)
+			while pending and (pending[0][0]==expected or item is _STOP):
+				sequence,data,result=heapq.heappop(pending)
+				expected=sequence+1
+				try:
+					self.write(data,result)
+					self.counters['written']+=1
+				except Exception as e:
+					if PRINT_DEBUG: print('Failed to write: ', str(e))
+					self.counters['write_errors']+=1
+			if item is _STOP: return
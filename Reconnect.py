@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+#######################################################################
+###   Reconnect.py:  Backing off before reconnecting to the stream  ###
+###   Copyright:     Elena Daehnhardt                               ###
+###   Contact me at: edaehn@gmail.com                               ###
+#######################################################################
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Twitter asks the stream clients to back off before reconnecting, the more
+# the longer the errors go on, and limits the clients which reconnect too
+# often for longer. The errors are handled with separate policies:
+#
+#   network:    connection errors and stalls, linear back-off
+#   http:       HTTP errors (5xx and others), exponential back-off
+#   rate_limit: HTTP 420 and 429, exponential back-off from a minute
+#
+# A random jitter of up to RECONNECT_JITTER of the delay is subtracted, so
+# that the collectors of supervise_tweets.py do not reconnect together.
+# All delays start again from the beginning after a successful connection.
+#
+# tweepy 3.7 connects again at once by itself when Twitter closes the stream,
+# the ScheduledStream returns from filter() instead when its listener says
+# so, so that the scheduler waits before every reconnect.
+
+import sys
+import time
+import random
+import threading
+from tweepy.streaming import Stream
+from config import *
+
+class Policy:
+	'''Back-off delays growing from start up to cap, linearly (by start) or exponentially (doubling)'''
+
+	def __init__(self,start,cap,exponential=True,jitter=RECONNECT_JITTER):
+		self.start=start
+		self.cap=cap
+		self.exponential=exponential
+		self.jitter=jitter
+		self.attempts=0
+
+	def delay(self):
+		'''Returns the delay before the next attempt'''
+		if self.exponential:
+			delay=min(self.cap,self.start*2**min(self.attempts,32))
+		else:
+			delay=min(self.cap,self.start*(self.attempts+1))
+		self.attempts+=1
+		return delay*(1-self.jitter*random.random())
+
+	def reset(self):
+		self.attempts=0
+
+
+def default_policies():
+	return {'network':Policy(RECONNECT_NETWORK_START,RECONNECT_NETWORK_CAP,exponential=False),
+		'http':Policy(RECONNECT_HTTP_START,RECONNECT_HTTP_CAP),
+		'rate_limit':Policy(RECONNECT_RATE_LIMIT_START,RECONNECT_RATE_LIMIT_CAP)}
+
+def classify(error):
+	'''Returns the policy for an error: an HTTP status code, 'timeout' or an exception'''
+	if isinstance(error,(int,long)):
+		return 'rate_limit' if error in (420,429) else 'http'
+	return 'network'
+
+
+class ReconnectScheduler:
+	'''Decides how long to wait before reconnecting and measures the downtime.
+	connected() is called on every successful connection, wait(error) after
+	the stream has stopped with the error.'''
+
+	def __init__(self,policies=None,sleep=time.sleep):
+		self.policies=policies or default_policies()
+		self.sleep=sleep
+		self.disconnected_at=None # start of the current outage
+		self.lock=threading.Lock()
+		self.counters={'connects':0, 'reconnects':0, 'network':0, 'http':0, 'rate_limit':0,
+			'downtime':0.0, 'longest_outage':0.0}
+
+	def connected(self):
+		with self.lock:
+			if self.disconnected_at is not None:
+				outage=time.time()-self.disconnected_at
+				self.counters['downtime']+=outage
+				self.counters['longest_outage']=max(self.counters['longest_outage'],outage)
+				self.counters['reconnects']+=1
+				self.disconnected_at=None
+			self.counters['connects']+=1
+			for policy in self.policies.values(): policy.reset()
+
+	def failed(self,error):
+		'''Counts the error, returns its policy and the delay before reconnecting'''
+		kind=classify(error)
+		with self.lock:
+			if self.disconnected_at is None: self.disconnected_at=time.time()
+			self.counters[kind]+=1
+			return kind,self.policies[kind].delay()
+
+	def wait(self,error):
+		kind,delay=self.failed(error)
+		print >>sys.stderr, "Stream stopped (%s: %s), reconnecting in %.1fs"%(kind,error,delay)
+		self.sleep(delay)
+
+	def downtime(self):
+		'''Seconds without a connection since the start, including the current outage'''
+		with self.lock:
+			downtime=self.counters['downtime']
+			if self.disconnected_at is not None: downtime+=time.time()-self.disconnected_at
+		return downtime
+
+
+class ScheduledStream(Stream):
+	'''tweepy Stream which stops when the stream was closed and listener.on_closed() returns False'''
+
+	def on_closed(self,resp):
+		on_closed=getattr(self.listener,'on_closed',None)
+		if on_closed is not None and on_closed() is False: self.running=False
@@ -0,0 +1,348 @@
+# -*- coding: utf-8 -*-
+#######################################################################
+###   StreamClient.py: Several stream connections in one event loop ###
+###   Copyright:     Elena Daehnhardt                               ###
+###   Contact me at: edaehn@gmail.com                               ###
+#######################################################################
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# The tweepy Stream blocks a thread per connection. The StreamClient serves
+# several filter connections, each with a share of the keywords, from a
+# single thread with non-blocking sockets and select(): connecting, the TLS
+# handshake, sending the request and reading the responses are steps of the
+# event loop. The chunked HTTP body is decoded and split into messages at
+# the newlines incrementally; the read buffer of a connection is scanned
+# once and shifted once per read, not for every message. The messages go to
+# on_data(), which in save_tweets.py submits them to the pipeline, so the
+# enrichment and the writing of the outputs never block the loop. Memory
+# stays bounded: STREAM_MAX_MESSAGE bytes per connection and the pipeline
+# queue, which slows down the reading when it is full.
+#
+# Every connection backs off on its own before reconnecting (see Reconnect.py).
+# Load test against a FakeStreamServer, started here without --fake-stream:
+#
+#   python StreamClient.py [--connections N] [--seconds S] [--fake-stream host:port] [--archive FILE]
+
+import sys
+import time
+import errno
+import socket
+import select
+import ssl
+import argparse
+import resource
+import requests
+from config import *
+import Reconnect
+from supervise_tweets import split_keywords
+
+FILTER_PATH='/1.1/statuses/filter.json'
+
+class ChunkedDecoder:
+	'''Incremental decoder of a chunked HTTP body'''
+
+	def __init__(self):
+		self.remaining=0 # bytes left in the current chunk
+		self.skip=0 # bytes of the CRLF after the chunk still to be skipped
+		self.line='' # beginning of a chunk size line
+		self.done=False
+
+	def feed(self,data,out):
+		'''Appends the payload in data to the bytearray out'''
+		view=memoryview(data)
+		position=0
+		while position<len(data) and not self.done:
+			if self.remaining:
+				take=min(self.remaining,len(data)-position)
+				out+=view[position:position+take]
+				position+=take
+				self.remaining-=take
+				if not self.remaining: self.skip=2
+			elif self.skip:
+				take=min(self.skip,len(data)-position)
+				position+=take
+				self.skip-=take
+			else:
+				end=data.find('\n',position)
+				if end<0:
+					self.line+=data[position:]
+					break
+				size=(self.line+data[position:end]).split(';')[0].strip()
+				self.line=''
+				position=end+1
+				self.remaining=int(size,16)
+				if not self.remaining: self.done=True
+
+
+class LineFramer:
+	'''Splits the body of the stream into messages at the newlines, skipping the keep-alive blank lines'''
+
+	def __init__(self,max_size=STREAM_MAX_MESSAGE):
+		self.buffer=bytearray()
+		self.scanned=0 # the buffer has no newline before this position
+		self.max_size=max_size
+
+	def messages(self):
+		'''Returns the complete messages in the buffer and removes them from it'''
+		buffer=self.buffer
+		messages=[]
+		start=0
+		view=memoryview(buffer)
+		while True:
+			end=buffer.find('\n',self.scanned)
+			if end<0: break
+			stop=end-1 if end>start and buffer[end-1]==13 else end
+			if stop>start: messages.append(view[start:stop].tobytes())
+			start=self.scanned=end+1
+		del view # a bytearray with a memoryview on it cannot be resized
+		if start: del buffer[:start]
+		self.scanned=len(buffer)
+		if len(buffer)>self.max_size: raise ValueError('Stream message of more than %d bytes'%self.max_size)
+		return messages
+
+
+def filter_request(auth,host,track):
+	'''Returns the signed HTTP request for a filter stream of the keywords'''
+	request=requests.Request('POST','https://%s%s'%(host,FILTER_PATH),data={'track':','.join(track)},
+		auth=auth.apply_auth() if auth is not None else None).prepare()
+	lines=['POST %s HTTP/1.1'%request.path_url,'Host: %s'%host,'User-Agent: save_tweets','Accept-Encoding: identity']
+	lines+=['%s: %s'%(name,value) for name,value in request.headers.items()]
+	return '\r\n'.join(lines)+'\r\n\r\n'+(request.body or '')
+
+
+class Connection:
+	'''One filter stream connection of the StreamClient, a state machine driven by the event loop:
+	waiting -> connecting -> handshake (TLS only) -> sending -> headers -> body -> waiting'''
+
+	def __init__(self,client,number,track):
+		self.client=client
+		self.number=number
+		self.track=track
+		self.scheduler=Reconnect.ReconnectScheduler()
+		self.sock=None
+		self.state='waiting'
+		self.wake=0 # time of the next connection attempt
+		self.want='write' # what the TLS handshake waits for
+		self.last_data=0
+		self.received=0
+
+	def fileno(self):
+		return self.sock.fileno()
+
+	def wants_read(self):
+		return self.state in ('headers','body') or (self.state=='handshake' and self.want=='read')
+
+	def wants_write(self):
+		return self.state in ('connecting','sending') or (self.state=='handshake' and self.want=='write')
+
+	def connect(self):
+		client=self.client
+		self.sock=socket.socket(socket.AF_INET,socket.SOCK_STREAM)
+		self.sock.setblocking(0)
+		self.state='connecting'
+		self.last_data=time.time()
+		self.outgoing=filter_request(client.auth,client.host,self.track)
+		self.head=''
+		self.decoder=None
+		self.framer=LineFramer(client.max_message)
+		error=self.sock.connect_ex((client.hostname,client.port))
+		if error not in (0,errno.EINPROGRESS,errno.EWOULDBLOCK): self.fail(socket.error(error,errno.errorcode.get(error)))
+
+	def on_writable(self):
+		if self.state=='connecting':
+			error=self.sock.getsockopt(socket.SOL_SOCKET,socket.SO_ERROR)
+			if error: return self.fail(socket.error(error,errno.errorcode.get(error)))
+			if self.client.secure:
+				self.sock=self.client.context.wrap_socket(self.sock,server_hostname=self.client.hostname,do_handshake_on_connect=False)
+				self.state='handshake'
+			else:
+				self.state='sending'
+		if self.state=='handshake': return self.handshake()
+		if self.state=='sending':
+			try:
+				sent=self.sock.send(self.outgoing)
+			except (ssl.SSLWantWriteError,ssl.SSLWantReadError):
+				return
+			self.outgoing=self.outgoing[sent:]
+			if not self.outgoing: self.state='headers'
+
+	def handshake(self):
+		try:
+			self.sock.do_handshake()
+			self.state='sending'
+		except ssl.SSLWantReadError:
+			self.want='read'
+		except ssl.SSLWantWriteError:
+			self.want='write'
+
+	def on_readable(self):
+		if self.state=='handshake': return self.handshake()
+		while self.sock is not None:
+			try:
+				data=self.sock.recv(65536)
+			except (ssl.SSLWantReadError,ssl.SSLWantWriteError):
+				return
+			except socket.error as e:
+				if e.errno in (errno.EAGAIN,errno.EWOULDBLOCK): return
+				raise
+			if not data: return self.fail(None) # closed by the server
+			self.last_data=time.time()
+			if self.state=='headers': self.on_head(data)
+			else: self.on_body(data)
+			# a TLS socket may hold decrypted data which select() does not see
+			if not isinstance(self.sock,ssl.SSLSocket) or not self.sock.pending(): return
+
+	def on_head(self,data):
+		self.head+=data
+		end=self.head.find('\r\n\r\n')
+		if end<0:
+			if len(self.head)>65536: self.fail(ValueError('HTTP response head too long'))
+			return
+		lines=self.head[:end].split('\r\n')
+		status=int(lines[0].split()[1])
+		if status!=200: return self.fail(status)
+		headers=dict((name.strip().lower(),value.strip().lower()) for name,_,value in (line.partition(':') for line in lines[1:]))
+		if headers.get('transfer-encoding')=='chunked': self.decoder=ChunkedDecoder()
+		self.state='body'
+		self.scheduler.connected()
+		self.client.counters['connects']+=1
+		body,self.head=self.head[end+4:],''
+		if body: self.on_body(body)
+
+	def on_body(self,data):
+		if self.decoder is not None:
+			self.decoder.feed(data,self.framer.buffer)
+		else:
+			self.framer.buffer+=data
+		for message in self.framer.messages():
+			self.received+=1
+			self.client.on_data(message)
+		if self.decoder is not None and self.decoder.done: self.fail(None)
+
+	def fail(self,error):
+		'''Closes the connection after the error and schedules the next attempt'''
+		self.close()
+		kind,delay=self.scheduler.failed(error)
+		print >>sys.stderr, "Stream %d stopped (%s: %s), reconnecting in %.1fs"%(self.number,kind,error,delay)
+		self.wake=time.time()+delay
+
+	def close(self):
+		if self.sock is not None:
+			try:
+				self.sock.close()
+			except socket.error:
+				pass
+		self.sock=None
+		self.state='waiting'
+
+
+class StreamClient:
+	'''Serves filter stream connections for the keyword lists in tracks in one thread.
+
+	Inputs:
+	auth: tweepy OAuthHandler signing the requests
+	tracks: a list of keywords for every connection, see split_keywords()
+	on_data: called with every raw message of the streams
+	host: host[:port] of the stream, a FakeStreamServer with secure=False
+	'''
+
+	def __init__(self,auth,tracks,on_data,host='stream.twitter.com',secure=True,timeout=STREAM_TIMEOUT,max_message=STREAM_MAX_MESSAGE):
+		self.auth=auth
+		self.on_data=on_data
+		self.host=host
+		self.hostname,_,port=host.partition(':')
+		self.secure=secure
+		self.port=int(port) if port else (443 if secure else 80)
+		self.context=ssl.create_default_context() if secure else None
+		self.timeout=timeout
+		self.max_message=max_message
+		self.connections=[Connection(self,number,track) for number,track in enumerate(tracks)]
+		self.stopped=False
+		self.counters={'connects':0, 'timeouts':0, 'errors':0}
+
+	def run(self):
+		'''The event loop, until stop()'''
+		while not self.stopped:
+			now=time.time()
+			for connection in self.connections:
+				if connection.state=='waiting':
+					if now>=connection.wake: self.step(connection,connection.connect)
+				elif self.timeout and now-connection.last_data>self.timeout:
+					self.counters['timeouts']+=1
+					connection.fail('timeout')
+			readers=[connection for connection in self.connections if connection.sock is not None and connection.wants_read()]
+			writers=[connection for connection in self.connections if connection.sock is not None and connection.wants_write()]
+			waiting=[connection.wake-now for connection in self.connections if connection.state=='waiting']
+			try:
+				readable,writable,_=select.select(readers,writers,[],max(0,min(waiting+[1.0])))
+			except select.error as e:
+				if e.args[0]!=errno.EINTR: raise
+				continue # a signal, which may have called stop()
+			for connection in writable: self.step(connection,connection.on_writable)
+			for connection in readable:
+				if connection.sock is not None: self.step(connection,connection.on_readable)
+		for connection in self.connections: connection.close()
+
+	def step(self,connection,function):
+		try:
+			function()
+		except Exception as e:
+			self.counters['errors']+=1
+			connection.fail(e)
+
+	def stop(self):
+		self.stopped=True
+
+	def downtime(self):
+		'''Seconds without a connection since the start, the sum over the connections'''
+		return sum(connection.scheduler.downtime() for connection in self.connections)
+
+	def stats(self):
+		stats=dict(self.counters)
+		stats['received']=[connection.received for connection in self.connections]
+		stats['reconnects']=sum(connection.scheduler.counters['reconnects'] for connection in self.connections)
+		return stats
+
+
+if __name__ == '__main__':
+	import threading
+	import FakeStream
+	import Corpus
+	parser=argparse.ArgumentParser(description='Load test of the StreamClient against a fake stream')
+	parser.add_argument('--connections', type=int, default=4)
+	parser.add_argument('--seconds', type=float, default=10)
+	parser.add_argument('--fake-stream', default=None, help='host:port of a FakeStream.py server, one is started here by default')
+	parser.add_argument('--archive', action='append', default=[], help='JSON archive with the tweets to be sent')
+	parser.add_argument('--tweets', type=int, default=10000, help='number of different tweets')
+	args=parser.parse_args()
+
+	host=args.fake_stream
+	server=None
+	if host is None:
+		tweets=Corpus.load_corpus(args.archive,args.tweets) if args.archive else Corpus.synthetic_tweets(args.tweets)
+		server=FakeStream.FakeStreamServer(('localhost',0),['stream'],tweets).start()
+		host='localhost:%d'%server.server_address[1]
+	received=[0,0] # messages, bytes
+	def count(data):
+		received[0]+=1
+		received[1]+=len(data)
+	keywords=['keyword%d'%number for number in range(args.connections)]
+	client=StreamClient(None,split_keywords(keywords,args.connections),count,host=host,secure=False)
+	threading.Timer(args.seconds,client.stop).start()
+	started=time.time()
+	client.run()
+	elapsed=time.time()-started
+	if server is not None: server.stop()
+	print "%d connections: %.0f messages/s, %.1f MB/s, peak RSS %.1f MB"%(args.connections,received[0]/elapsed,
+		received[1]/elapsed/1048576,resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1024.)
+	print "Stats: %s"%client.stats()
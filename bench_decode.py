@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+#######################################################################
+###   bench_decode.py: Comparing the JSON decoders of the tweets    ###
+###   Copyright:     Elena Daehnhardt                               ###
+###   Contact me at: edaehn@gmail.com                               ###
+#######################################################################
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Decodes a corpus of raw tweets with every installed decoder of Decoder.py,
+# full and partial, and extracts the CSV rows from the decoded tweets:
+#
+#   python bench_decode.py [--limit N] [--repeat R] [archive ...]
+#
+# Without archives a synthetic corpus is used (see Corpus.py). The fastest
+# decoder giving the same rows as the standard json module is the one to set
+# in JSON_DECODER.
+
+import time
+import argparse
+from config import *
+import Corpus
+import Decoder
+import Enrichment
+
+def bench(loads,corpus,repeat):
+	'''Returns the best decoding and extraction times of the corpus in seconds, and the extracted rows'''
+	enricher=Enrichment.Enricher(None,loads)
+	decode_time=extract_time=float('inf')
+	for _ in range(repeat):
+		started=time.time()
+		statuses=[loads(data) for data in corpus]
+		decoded=time.time()
+		rows=[enricher.extract(status)[0] for status in statuses]
+		decode_time=min(decode_time,decoded-started)
+		extract_time=min(extract_time,time.time()-decoded)
+	return decode_time,extract_time,rows
+
+if __name__ == '__main__':
+	parser=argparse.ArgumentParser(description='Compares the JSON decoders on a corpus of raw tweets')
+	parser.add_argument('archives', nargs='*', help='JSON archives saved by save_tweets.py, a synthetic corpus by default')
+	parser.add_argument('--limit', type=int, default=20000, help='number of tweets')
+	parser.add_argument('--repeat', type=int, default=3, help='runs per decoder, the best one is reported')
+	args=parser.parse_args()
+
+	corpus=Corpus.load_corpus(args.archives,args.limit) if args.archives else Corpus.synthetic_tweets(args.limit)
+	size=sum(len(data) for data in corpus)
+	print "%d tweets, %.1f MB, average %d bytes"%(len(corpus),size/1e6,size/max(len(corpus),1))
+	print "%-10s %-8s %12s %12s %12s  %s"%('decoder','mode','tweets/s','MB/s','rows/s','rows')
+
+	# the rows of the standard json module, fully decoded, are the reference
+	loads=Decoder.get_decoder('json',False)
+	enricher=Enrichment.Enricher(None,loads)
+	expected=[enricher.extract(loads(data))[0] for data in corpus]
+	for name in Decoder.available():
+		for partial in [False,True]:
+			decode_time,extract_time,rows=bench(Decoder.get_decoder(name,partial),corpus,args.repeat)
+			print "%-10s %-8s %12.0f %12.1f %12.0f  %s"%(name,'partial' if partial else 'full',
+				len(corpus)/decode_time,size/1e6/decode_time,len(corpus)/(decode_time+extract_time),
+				'same' if rows==expected else 'DIFFERENT')
+	missing=[name for name in Decoder.BACKENDS if name not in Decoder.available()]
+	if missing: print "Not installed: %s"%', '.join(missing)
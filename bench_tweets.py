@@ -0,0 +1,231 @@
+# -*- coding: utf-8 -*-
+#######################################################################
+###   bench_tweets.py: Throughput of the collector without Twitter  ###
+###   Copyright:     Elena Daehnhardt                               ###
+###   Contact me at: edaehn@gmail.com                               ###
+#######################################################################
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Feeds a corpus of raw tweets to StdOutListener.on_data of save_tweets.py,
+# as the stream does, and measures the tweets per second, the latency per
+# tweet (until the row is written in the pipeline mode) and the peak memory:
+#
+#   python bench_tweets.py [--tweets N] [--rate R] [--outputs csv,json,parquet,sqlite,aggregates]
+#                          [--classifiers cached,uncached,model] [--modes direct,pipeline]
+#                          [--save FILE] [--compare FILE] [--max-growth MB] [archive ...]
+#
+# Every combination of output, classifier and mode runs in a process of its
+# own, writing into a temporary directory. The 'cached' and 'uncached'
+# classifiers are a tiny model trained here, with and without the classifier
+# cache, 'model' is the newest model in ./models/. Without archives the corpus
+# is synthetic (see Corpus.py). --save keeps the results, --compare fails when
+# the tweets per second fell by more than --tolerance against saved results.
+#
+# The growth of the peak memory after the first quarter of the tweets, when the
+# caches and the buffers (the PARQUET_ROW_GROUP rows of a Parquet row group)
+# have filled up, is measured too. --max-growth fails when it is over the
+# limit, a check that the memory stays flat for long-running collectors, for
+# example for a million tweets:
+#
+#   python bench_tweets.py --tweets 1000000 --outputs csv,parquet --classifiers cached --max-growth 20
+#
+# Corpora of more than CORPUS_SIZE tweets repeat the first CORPUS_SIZE tweets
+# with new tweet and user ids every round (see Corpus.cycled()), so the
+# Deduplicator and the caches keep seeing new keys. test_memory.py checks that
+# their sizes and the memory stay bounded.
+
+import os
+import sys
+import json
+import time
+import shutil
+import resource
+import random
+import tempfile
+import argparse
+import subprocess
+from collections import deque
+from config import *
+import Corpus
+
+basedir=os.path.abspath(os.path.dirname(__file__))
+CORPUS_SIZE=20000 # the distinct tweets kept in memory
+LATENCY_SAMPLES=100000 # the latencies kept for the percentiles, a uniform sample of all
+
+def make_stub_model(models_dir):
+	'''Saves a tiny META classifier guessing the country from the user language into models_dir/stub'''
+	import pandas
+	from sklearn.pipeline import Pipeline
+	from sklearn.feature_extraction.text import CountVectorizer
+	from sklearn.naive_bayes import MultinomialNB
+	try:
+		import joblib
+	except ImportError:
+		from sklearn.externals import joblib
+	import Classifier
+	countries=['GB', 'ES', 'SA', 'JP', 'BR', 'FR', 'DE', 'TR', 'RU', 'IT']
+	texts=['%s %s %s'%(language,time_zone or '',location) for language,time_zone,location in
+		zip(Corpus.LANGUAGES,Corpus.TIME_ZONES,[location.encode('utf-8') for location in Corpus.LOCATIONS])]
+	classifier=Classifier.Classifier()
+	classifier.classifier=Pipeline([('vectorizer',CountVectorizer()),('model',MultinomialNB())]).fit(texts,range(len(countries)))
+	classifier.labels={'Country':pandas.DataFrame({'Country':countries})}
+	os.makedirs(os.path.join(models_dir,'stub'))
+	joblib.dump(classifier,os.path.join(models_dir,'stub','META'))
+
+def percentile(values,q):
+	if not values: return 0.0
+	return values[min(len(values)-1,int(q*len(values)))]
+
+def sampler(latencies,size=LATENCY_SAMPLES):
+	'''Returns a function keeping a uniform sample of size latencies in the list (reservoir sampling)'''
+	rand=random.Random(0)
+	seen=[0]
+	def observe(latency):
+		seen[0]+=1
+		if len(latencies)<size:
+			latencies.append(latency)
+		else:
+			slot=rand.randrange(seen[0])
+			if slot<size: latencies[slot]=latency
+	return observe
+
+def run(args,output,classifier,mode):
+	'''Runs one combination in this process, returns its results'''
+	workdir=tempfile.mkdtemp(prefix='bench_tweets_')
+	try:
+		import config
+		config.SAFE_CSV=output=='csv'
+		config.SAFE_JSON=output=='json'
+		config.SAFE_PARQUET=output=='parquet'
+		config.SAFE_SQLITE=output=='sqlite'
+		config.SAFE_AGGREGATES=output=='aggregates'
+		config.CLASSIFIER_CACHE_SIZE=0 if classifier=='uncached' else CLASSIFIER_CACHE_SIZE
+		config.DEDUP=args.dedup
+		config.MODEL_WATCH_INTERVAL=0
+		config.METRICS_INTERVAL=0
+		models_dir=os.path.join(basedir,'models')
+		if classifier!='model':
+			models_dir=os.path.join(workdir,'models')
+			make_stub_model(models_dir)
+		size=min(args.tweets,CORPUS_SIZE)
+		corpus=Corpus.load_corpus(args.archives,size) if args.archives else Corpus.synthetic_tweets(size)
+		tweets=args.tweets if corpus else 0
+		sys.argv=[sys.argv[0],'--output',os.path.join(workdir,'output'),'--models',models_dir]
+		import save_tweets
+		import Pipeline
+		save_tweets.c2.snapshot() # waits for the model
+
+		latencies=[]
+		observe=sampler(latencies)
+		in_flight=deque() # (raw tweet, submission time) in the order of the pipeline
+		if mode=='pipeline':
+			def write(data,tweet):
+				save_tweets.save_tweet(data,tweet)
+				now=time.time()
+				while in_flight:
+					submitted,started=in_flight.popleft()
+					if submitted is data:
+						observe(now-started)
+						break
+			save_tweets.pipeline=Pipeline.Pipeline(save_tweets.enricher.process,write).start()
+		listener=save_tweets.StdOutListener()
+
+		warmed_up=max(1,tweets//4)
+		warm_rss=0
+		started=time.time()
+		for number,data in enumerate(Corpus.cycled(corpus,tweets)):
+			if number==warmed_up: warm_rss=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+			if args.rate: time.sleep(max(0,started+float(number)/args.rate-time.time()))
+			received=time.time()
+			if mode=='pipeline': in_flight.append((data,received))
+			listener.on_data(data)
+			if mode=='direct': observe(time.time()-received)
+		if save_tweets.pipeline is not None: save_tweets.pipeline.close()
+		for sink in save_tweets.row_sinks+[save_tweets.json_sink]:
+			if sink is not None: sink.close()
+		elapsed=time.time()-started
+
+		latencies.sort()
+		peak_rss=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+		return {'output':output, 'classifier':classifier, 'mode':mode, 'tweets':tweets,
+			'written':save_tweets.metrics.total('added'), 'tweets_per_second':tweets/elapsed,
+			'p50_ms':percentile(latencies,0.5)*1000, 'p99_ms':percentile(latencies,0.99)*1000,
+			'peak_rss_mb':peak_rss/1024., 'rss_growth_mb':(peak_rss-(warm_rss or peak_rss))/1024.}
+	finally:
+		shutil.rmtree(workdir,ignore_errors=True)
+
+def key(result):
+	return '%s/%s/%s'%(result['output'],result['classifier'],result['mode'])
+
+if __name__ == '__main__':
+	parser=argparse.ArgumentParser(description='Measures the throughput of save_tweets.py on a corpus of raw tweets')
+	parser.add_argument('archives', nargs='*', help='JSON archives saved by save_tweets.py, a synthetic corpus by default')
+	parser.add_argument('--tweets', type=int, default=20000, help='number of tweets')
+	parser.add_argument('--rate', type=float, default=0, help='tweets per second, as fast as possible by default')
+	parser.add_argument('--outputs', default='csv,json,parquet,sqlite,aggregates')
+	parser.add_argument('--classifiers', default='cached,uncached', help="'cached', 'uncached' (the tiny model) and 'model'")
+	parser.add_argument('--modes', default='direct,pipeline')
+	parser.add_argument('--no-dedup', dest='dedup', action='store_false', help='keep the duplicate tweets as DEDUP=False')
+	parser.add_argument('--save', default=None, help='JSON file for the results')
+	parser.add_argument('--compare', default=None, help='JSON file of earlier results')
+	parser.add_argument('--tolerance', type=float, default=0.2, help='allowed fall of the tweets per second against --compare')
+	parser.add_argument('--max-growth', type=float, default=0, help='allowed growth of the peak memory in MB after the warm-up')
+	parser.add_argument('--run', default=None, help=argparse.SUPPRESS) # output/classifier/mode, in the child process
+	args=parser.parse_args()
+
+	if args.run:
+		print 'RESULT '+json.dumps(run(args,*args.run.split('/')))
+		sys.exit(0)
+
+	outputs=args.outputs.split(',')
+	if 'parquet' in outputs:
+		try:
+			import pyarrow
+		except ImportError:
+			print "Skipping the Parquet output, pyarrow is not installed"
+			outputs.remove('parquet')
+	results=[]
+	print "%-30s %10s %10s %10s %10s %10s %8s"%('output/classifier/mode','tweets/s','p50 ms','p99 ms','RSS MB','growth MB','written')
+	for output in outputs:
+		for classifier in args.classifiers.split(','):
+			for mode in args.modes.split(','):
+				command=[sys.executable,os.path.abspath(__file__),'--run','%s/%s/%s'%(output,classifier,mode),
+					'--tweets',str(args.tweets),'--rate',str(args.rate)]+([] if args.dedup else ['--no-dedup'])+args.archives
+				child=subprocess.Popen(command,stdout=subprocess.PIPE)
+				lines=[line for line in child.communicate()[0].splitlines() if line.startswith('RESULT ')]
+				if child.returncode or not lines:
+					print "%-30s failed with exit code %s"%('%s/%s/%s'%(output,classifier,mode),child.returncode)
+					continue
+				result=json.loads(lines[-1][len('RESULT '):])
+				results.append(result)
+				print "%-30s %10.0f %10.3f %10.3f %10.1f %10.1f %8d"%(key(result),result['tweets_per_second'],
+					result['p50_ms'],result['p99_ms'],result['peak_rss_mb'],result['rss_growth_mb'],result['written'])
+
+	failed=False
+	if args.max_growth:
+		for result in results:
+			if result['rss_growth_mb']>args.max_growth:
+				print "MEMORY %s: the peak memory grew by %.1f MB after the warm-up"%(key(result),result['rss_growth_mb'])
+				failed=True
+	if args.save:
+		with open(args.save,'w') as f: json.dump(results,f,indent=1)
+	if args.compare:
+		with open(args.compare) as f: baseline=dict((key(result),result) for result in json.load(f))
+		regressions=[]
+		for result in results:
+			before=baseline.get(key(result))
+			if before and result['tweets_per_second']<before['tweets_per_second']*(1-args.tolerance):
+				regressions.append("%s: %.0f tweets/s, was %.0f"%(key(result),result['tweets_per_second'],before['tweets_per_second']))
+		for regression in regressions: print "REGRESSION %s"%regression
+		if regressions: failed=True
+	if failed: sys.exit(1)
@@ -35,4 +35,159 @@ SAFE_JSON=False
 
 ################## If you want to store CSV into the output directory 
 # (CSV file includes also the country inference)
-SAFE_CSV=True
\ No newline at end of file
+SAFE_CSV=True
+
+################## Output buffering: rows are kept in memory and written in batches
+# when FLUSH_ROWS rows are waiting or FLUSH_INTERVAL seconds have passed since
+# the last flush, checked every second also while no tweets arrive. Ctrl+C or
+# SIGTERM always flushes the remaining rows to disk.
+FLUSH_ROWS=500
+FLUSH_INTERVAL=5
+
+################## Pipeline mode: the stream only puts the tweets into a queue of
+# PIPELINE_QUEUE_SIZE tweets, PIPELINE_WORKERS threads classify them and a single
+# writer saves them in the order received. When the queue is full, the stream waits
+# up to PIPELINE_PUT_TIMEOUT seconds (PIPELINE_BLOCK=True) before dropping the tweet.
+PIPELINE_MODE=False
+PIPELINE_WORKERS=4
+PIPELINE_QUEUE_SIZE=10000
+PIPELINE_BLOCK=True
+PIPELINE_PUT_TIMEOUT=1
+# Each worker classifies up to PIPELINE_BATCH_SIZE tweets at once, waiting at most
+# PIPELINE_BATCH_WAIT seconds for a batch to fill up
+PIPELINE_BATCH_SIZE=256
+PIPELINE_BATCH_WAIT=0.05
+
+################## The inferred countries are cached for the last CLASSIFIER_CACHE_SIZE
+# distinct meta texts (user language, time zone and location), 0 disables the cache.
+# Cached results expire after CLASSIFIER_CACHE_TTL seconds, 0 keeps them until evicted.
+CLASSIFIER_CACHE_SIZE=100000
+CLASSIFIER_CACHE_TTL=0
+
+################## Countries with their Lewis dimensions and languages used for the
+# country inference, add new countries to this file
+LOCALITY_FILE='locality.csv'
+
+################## Replaying the JSON archives with replay_tweets.py: number of processes
+# (0 for all cores), tweets classified at once and tweets between the progress checkpoints.
+# Newline-delimited archives are replayed in parallel byte ranges of REPLAY_SHARD_BYTES.
+REPLAY_PROCESSES=0
+REPLAY_BATCH_SIZE=256
+REPLAY_CHECKPOINT_EVERY=10000
+REPLAY_SHARD_BYTES=64*1024*1024
+
+################## The JSON archives are newline-delimited JSON files, compressed when
+# JSON_COMPRESSION is 'gzip' or 'zstd' (needs the zstandard package), '' for plain text.
+# Every JSON_INDEX_EVERY tweets the offset is saved in the .idx file next to the archive.
+JSON_COMPRESSION=''
+JSON_INDEX_EVERY=10000
+
+################## If you want to store the CSV columns into typed Parquet files as well
+# (needs the pyarrow package). Every PARQUET_ROW_GROUP rows are written as a row group,
+# a file is readable when the collector stops.
+SAFE_PARQUET=False
+PARQUET_ROW_GROUP=100000
+
+################## The model is memory-mapped with MODEL_MMAP_MODE='r', so that several
+# collector processes share one copy of it in memory, None loads a private copy
+MODEL_MMAP_MODE='r'
+# Every MODEL_WATCH_INTERVAL seconds the collector checks ./models/ for a newer model and
+# switches to it without stopping the stream, 0 keeps the model loaded at startup
+MODEL_WATCH_INTERVAL=60
+
+################## JSON decoder for the tweets: 'auto' for the fastest installed one of
+# 'orjson', 'simdjson', 'ujson' and the standard 'json'. JSON_PARTIAL=True keeps only the
+# parts of the tweets used for the CSV rows (see python bench_decode.py)
+JSON_DECODER='auto'
+JSON_PARTIAL=True
+
+################## supervise_tweets.py splits the STREAM_FILTER keywords between STREAM_SHARDS
+# collectors (0 for one per CPU core), each with its own stream connection and output files
+# in ./output/shards/<shard>/. A collector which stops is started again after SHARD_RESTART_DELAY
+# seconds, doubled up to SHARD_RESTART_MAX while it keeps stopping within SHARD_MIN_UPTIME seconds.
+# The shard outputs of the past days are merged into the daily outputs every SHARD_MERGE_INTERVAL
+# seconds, all of them when a collector stops. When stopping, the collectors get SHARD_STOP_TIMEOUT
+# seconds to close their outputs after Ctrl+C, then they are terminated and after as long again killed
+STREAM_SHARDS=0
+SHARD_RESTART_DELAY=5
+SHARD_RESTART_MAX=300
+SHARD_MIN_UPTIME=60
+SHARD_MERGE_INTERVAL=600
+SHARD_STOP_TIMEOUT=60
+
+################## Tweets received more than once (after reconnects, or matching several streams)
+# are dropped before the country inference with DEDUP=True. The ids of the last DEDUP_RECENT tweets
+# are kept exactly, the older ones in two Bloom filters of DEDUP_MEMORY_MB together, each holding
+# the ids for the false positive rate DEDUP_FP_RATE (about 7 million ids with 32 MB and 0.0001)
+DEDUP=True
+DEDUP_MEMORY_MB=32
+DEDUP_RECENT=100000
+DEDUP_FP_RATE=0.0001
+
+################## Reconnecting to the stream (see Reconnect.py): the delays in seconds start at
+# *_START and grow up to *_CAP, linearly for the network errors and doubling for the HTTP errors
+# and the rate limits (HTTP 420 and 429). A stream without data for STREAM_TIMEOUT seconds
+# is reconnected (Twitter sends keep-alives every 30 seconds)
+RECONNECT_NETWORK_START=0.25
+RECONNECT_NETWORK_CAP=16
+RECONNECT_HTTP_START=5
+RECONNECT_HTTP_CAP=320
+RECONNECT_RATE_LIMIT_START=60
+RECONNECT_RATE_LIMIT_CAP=960
+RECONNECT_JITTER=0.5
+STREAM_TIMEOUT=90
+
+################## Metrics (see Metrics.py): a stats line with the tweets per second and the latencies
+# every METRICS_INTERVAL seconds (0 for none). With METRICS_PORT the metrics are served in the
+# Prometheus text format on http://localhost:METRICS_PORT/metrics, by the collector of shard N
+# of supervise_tweets.py on port METRICS_PORT+N (the supervisor serves none). With PRINT_DEBUG=True the
+# details of one tweet in PRINT_DEBUG_SAMPLE are printed
+METRICS_INTERVAL=60
+METRICS_PORT=0
+PRINT_DEBUG_SAMPLE=1000
+
+################## Output rotation: a new output file is started every day, and when a file has
+# grown over ROTATE_MB megabytes (0 for no limit) as twitter_YYYY-MM-DD_1.csv and so on.
+# With COMPRESS_CLOSED=True the closed CSV files and uncompressed JSON archives are gzipped
+# in the background. The files of more than RETENTION_DAYS days ago are removed (0 keeps all)
+ROTATE_MB=0
+COMPRESS_CLOSED=False
+RETENTION_DAYS=0
+
+################## If you want to store the rows into the SQLite database ./output/db/twitter.sqlite
+# (indexed by date, inferred country and user id, the hashtags and user mentions in tables of their own)
+SAFE_SQLITE=False
+
+################## The user columns of the last PROFILE_CACHE_SIZE users and their inferred country
+# are cached by user id, the tweets of these users are then not classified again (0 for no cache)
+PROFILE_CACHE_SIZE=100000
+
+################## Pre-filtering of the stream before the enrichment (see Filters.py): the control messages
+# are never written, the tweets in other languages than FILTER_LANGUAGES (all with []), the retweets with
+# FILTER_RETWEETS=True, the quote tweets with FILTER_QUOTES=True and, with FILTER_KEYWORDS=True, the tweets
+# without a keyword of the stream are dropped. SAMPLE_RATE is the share of the tweets kept, by tweet id
+FILTER_LANGUAGES=[]
+FILTER_RETWEETS=False
+FILTER_QUOTES=False
+FILTER_KEYWORDS=False
+SAMPLE_RATE=1.0
+
+################## With STREAM_CONNECTIONS>0 the keywords are split between that many stream connections
+# served by one event loop (see StreamClient.py) instead of the tweepy Stream, and the tweets are enriched
+# and written in the pipeline. A stream message may have up to STREAM_MAX_MESSAGE bytes
+STREAM_CONNECTIONS=0
+STREAM_MAX_MESSAGE=1048576
+
+################## If you want the counts per inferred country and dimension in ./output/aggregates.json
+# (see Aggregates.py): the tweets per minute for the last AGGREGATE_MINUTES minutes and in total, the
+# AGGREGATE_TOP_K top hashtags and mentions per country and the inference strengths, saved every
+# AGGREGATE_INTERVAL seconds by a thread of its own. A restarted collector counts on from its saved file
+SAFE_AGGREGATES=False
+AGGREGATE_MINUTES=60
+AGGREGATE_TOP_K=20
+AGGREGATE_INTERVAL=60
+
+################## train_model.py reads the outputs TRAIN_CHUNK_ROWS rows at a time and hashes the words
+# of the meta texts into 2**TRAIN_FEATURE_BITS features, the model takes 8 bytes per feature and country
+TRAIN_CHUNK_ROWS=100000
+TRAIN_FEATURE_BITS=18
@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+#######################################################################
+###   replay_tweets.py: Re-enriching the saved JSON archives         ###
+###   Copyright:     Elena Daehnhardt                               ###
+###   Contact me at: edaehn@gmail.com                               ###
+#######################################################################
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Runs the country inference of save_tweets.py again over the JSON archives
+# saved with SAFE_JSON=True, for example after retraining the model:
+#
+#   python replay_tweets.py [--model NAME] [--processes N] [--output DIR] [archive ...]
+#
+# The newline-delimited archives are split at their indexed blocks into byte
+# ranges of about REPLAY_SHARD_BYTES, older archives of JSON string literals
+# are replayed as a whole. The processes of the pool replay the ranges into a
+# CSV file of the same name in the output directory. The progress is
+# checkpointed next to the CSV files, so running the same command again
+# resumes an interrupted replay.
+
+import os
+import glob
+import csv
+import json
+import shutil
+import argparse
+import itertools
+import multiprocessing
+from config import *
+import Output
+import Models
+import Archive
+import Enrichment
+import Filters
+
+enricher=None
+
+def init_worker(model):
+	global enricher
+	try:
+		# the control messages in the archives are skipped, the tweets kept by the same rules as collected
+		enricher=Enrichment.Enricher(Models.StaticModel(model,Models.load_model(model)), prefilter=Filters.Filter())
+	except Models.ModelLoadError as e:
+		enricher=e # raised by replay(), the pool would restart a failing initializer forever
+
+def load_checkpoint(filename):
+	if os.path.isfile(filename):
+		with open(filename) as f:
+			return json.load(f)
+	return {'offset':0, 'records':0, 'output_size':0, 'done':False}
+
+def save_checkpoint(filename,checkpoint):
+	with open(filename+'.tmp','w') as f:
+		json.dump(checkpoint,f)
+		f.flush()
+		os.fsync(f.fileno())
+	os.rename(filename+'.tmp',filename)
+
+def batches(records,size):
+	batch=[]
+	for record in records:
+		batch.append(record)
+		if len(batch)==size:
+			yield batch
+			batch=[]
+	if batch: yield batch
+
+def replay(job):
+	'''Replays one archive, or a byte range of it, into a CSV file, returns (job, records, resumed)'''
+	if isinstance(enricher,Exception): raise enricher
+	archive,start,end,output_file=job
+	checkpoint_file=output_file+'.checkpoint'
+	checkpoint=load_checkpoint(checkpoint_file)
+	resumed=checkpoint['records']>0
+	if checkpoint['done']: return job,checkpoint['records'],resumed
+	# rows written after the last checkpoint are replayed again
+	if os.path.isfile(output_file):
+		if checkpoint['output_size']:
+			with open(output_file,'r+b') as f: f.truncate(checkpoint['output_size'])
+		else:
+			os.remove(output_file)
+	# the byte ranges of a newline-delimited archive are merged into one CSV file later
+	sink=Output.CSVSink(output_file, header=Enrichment.header if start is None else None, flush_rows=REPLAY_BATCH_SIZE)
+	if start is None:
+		# archive of JSON string literals, resumed at the checkpointed offset
+		f=open(archive,'rb')
+		f.seek(checkpoint['offset'])
+		tweets=Archive.read_literals(f,checkpoint['offset'])
+	else:
+		tweets=((None,data) for data in itertools.islice(Archive.read_archive(archive,start,end),checkpoint['records'],None))
+	last_checkpoint=checkpoint['records']
+	for batch in batches(tweets,REPLAY_BATCH_SIZE):
+		for tweet in enricher.process([data for _,data in batch]):
+			if tweet is not None and tweet is not Enrichment.FILTERED: sink.write(tweet)
+		if start is None: checkpoint['offset']=batch[-1][0]
+		checkpoint['records']+=len(batch)
+		if checkpoint['records']-last_checkpoint>=REPLAY_CHECKPOINT_EVERY:
+			sink.flush(sync=True)
+			checkpoint['output_size']=os.path.getsize(output_file)
+			save_checkpoint(checkpoint_file,checkpoint)
+			last_checkpoint=checkpoint['records']
+	if start is None: f.close()
+	sink.close()
+	checkpoint['output_size']=os.path.getsize(output_file)
+	checkpoint['done']=True
+	save_checkpoint(checkpoint_file,checkpoint)
+	return job,checkpoint['records'],resumed
+
+def jobs(archive,output_dir):
+	'''Splits an archive into replay jobs, returns the CSV file and the jobs'''
+	name=os.path.basename(archive).split('.')[0]
+	output_file=os.path.join(output_dir,name+'.csv')
+	if load_checkpoint(output_file+'.checkpoint')['done']: return output_file,[]
+	if archive.endswith('.txt'): return output_file,[(archive,None,None,output_file)]
+	return output_file,[(archive,start,end,'%s.part%04d'%(output_file,part))
+		for part,(start,end,_) in enumerate(Archive.shards(archive,REPLAY_SHARD_BYTES))]
+
+def merge(output_file,parts):
+	'''Concatenates the CSV files of the byte ranges of an archive'''
+	with open(output_file,'wb') as f:
+		csv.writer(f, dialect='excel').writerow(Enrichment.header)
+		for part in parts:
+			with open(part,'rb') as p: shutil.copyfileobj(p,f)
+		f.flush()
+		os.fsync(f.fileno())
+	save_checkpoint(output_file+'.checkpoint',{'offset':0, 'records':0, 'output_size':os.path.getsize(output_file), 'done':True})
+	for part in parts:
+		os.remove(part)
+		os.remove(part+'.checkpoint')
+
+if __name__ == '__main__':
+	parser=argparse.ArgumentParser(description='Re-enriches the JSON archives saved by save_tweets.py into CSV files')
+	parser.add_argument('archives', nargs='*', help='JSON archives, all in ./output/json/ by default')
+	parser.add_argument('--model', default=None, help='model directory in ./models/, the newest by default')
+	parser.add_argument('--processes', type=int, default=REPLAY_PROCESSES, help='number of processes, all cores by default')
+	parser.add_argument('--output', default='./output/replay/', help='output directory for the CSV files')
+	args=parser.parse_args()
+
+	# only the complete archives, not their index files nor the .tmp files of a compression in progress
+	archives=args.archives or sorted(glob.glob('./output/json/twitter_*.txt')+
+		[archive for extension in Archive.EXTENSIONS.values() for archive in glob.glob('./output/json/twitter_*'+extension)])
+	# skip the index and .tmp files given on the command line and the old archives which were converted by Archive.py
+	archives=[archive for archive in archives if not archive.endswith(('.idx','.tmp')) and
+		not (archive.endswith('.txt') and any(glob.glob(archive[:-len('.txt')]+extension) for extension in Archive.EXTENSIONS.values()))]
+	model=args.model or Models.latest_model()
+	if not os.path.exists(args.output): os.makedirs(args.output)
+	print "Replaying %d archives with the model %s"%(len(archives),model)
+
+	pending={} # CSV file -> byte range jobs of the archive which are not finished yet
+	all_jobs=[]
+	for archive in archives:
+		output_file,archive_jobs=jobs(archive,args.output)
+		if not archive_jobs: print "%s: already replayed into %s"%(archive,output_file)
+		elif archive_jobs[0][1] is not None: pending[output_file]=set(job[3] for job in archive_jobs)
+		all_jobs+=archive_jobs
+
+	pool=multiprocessing.Pool(args.processes or None, init_worker, (model,))
+	try:
+		for (archive,start,end,output_file),records,resumed in pool.imap_unordered(replay,all_jobs):
+			print "%s%s: %d tweets%s"%(archive,'' if start is None else ' [%d:%d]'%(start,end),records,' (resumed)' if resumed else '')
+			if start is None: continue
+			csv_file=output_file.rsplit('.part',1)[0]
+			pending[csv_file].discard(output_file)
+			if not pending[csv_file]:
+				merge(csv_file,sorted(job[3] for job in all_jobs if job[3].startswith(csv_file+'.part')))
+	finally:
+		pool.close()
+		pool.join()
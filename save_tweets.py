@@ -17,74 +17,159 @@
 # limitations under the License.
 
 ########### Importing the necessary methods and libraries ##############
+import time
+started=time.time()
 import tweepy
 from tweepy.streaming import StreamListener
 from tweepy import OAuthHandler
 from tweepy.streaming import Stream
 import urllib
 import os
-import time
 import signal
 import codecs
-import json
-from datetime import date
 import sys
-import csv
+import argparse
 from config import *
-
-global tweets_added
-tweets_added=0
+import Output
+import Archive
+import Pipeline
+import Models
+import Enrichment
+import Dedup
+import Filters
+import Aggregates
+import Reconnect
+from Metrics import metrics, sampled
+
+def startup_phase(phase, started):
+	"""Prints the time spent in a startup phase, returns the start time of the next one"""
+	print "Startup: %s in %.3fs"%(phase, time.time()-started)
+	return time.time()
+
+started=startup_phase('imports', started)
+
+############ Command line options, supervise_tweets.py runs a collector per keyword shard
+parser=argparse.ArgumentParser(description='Collects the tweets of the Twitter stream with the country inference')
+parser.add_argument('--track', default=None, help='comma-separated keywords, STREAM_FILTER by default')
+parser.add_argument('--output', default='./output/', help='output directory')
+parser.add_argument('--models', default=Models.models_dir, help='directory of the classification models')
+parser.add_argument('--fake-stream', default=None, help='host:port of a FakeStream.py server to connect to instead of Twitter')
+parser.add_argument('--metrics-port', type=int, default=METRICS_PORT, help='port serving the metrics, 0 for none')
+parser.add_argument('--connections', type=int, default=STREAM_CONNECTIONS, help='stream connections in one event loop (StreamClient.py), 0 for the tweepy Stream')
+args,_=parser.parse_known_args()
+track=args.track.split(',') if args.track else STREAM_FILTER
+output_dir=os.path.join(args.output,'')
 
 
 
 
 ############ Loading the Classification model ##########################
-basedir = os.path.abspath(os.path.dirname(__file__))
-models_dir = os.path.join(basedir, 'models/')
-models_subdirs=[models_dir+s for s in os.listdir(models_dir) if os.path.isdir(models_dir+s)]
-MODEL=max(models_subdirs, key=os.path.getmtime)
-MODEL=MODEL.rsplit('/', 1)[-1]
-if PRINT_DEBUG: print "MODEL=%s"%MODEL
-import Classifier
-from Locality import getDimension
-
-from sklearn.externals import joblib
-c2=Classifier.Classifier() 
-filename='./models/'+MODEL+'/META'
-try:
-	c2 = joblib.load(filename)	
-except:
-	pass
+# the model is loaded in the background while the outputs are opened and the stream connects,
+# then newer models in ./models/ are loaded without stopping the stream (MODEL_WATCH_INTERVAL)
+c2=Models.LazyModel(models_dir=os.path.join(args.models,''))
+# the tweets received more than once are dropped before their classification
+enricher=Enrichment.Enricher(c2, dedup=Dedup.Deduplicator() if DEDUP else None, prefilter=Filters.Filter(track))
 
 
 ############ Creating output directories if needed
-for dir_is_needed, directory in zip([SAFE_CSV, SAFE_JSON],['./output/csv/','./output/json/']):
+for dir_is_needed, directory in zip([SAFE_CSV, SAFE_JSON, SAFE_PARQUET, SAFE_SQLITE],[output_dir+'csv/',output_dir+'json/',output_dir+'parquet/',output_dir+'db/']):
 	if dir_is_needed and not os.path.exists(directory):
 		os.makedirs(directory)	
 
-############ Checking if CSV output files exist, otherwise we create it with headers
+############ Opening the output files, they are kept open while collecting
+csv_sink=json_sink=parquet_sink=sqlite_sink=aggregates=None
+# a new file is started every day and after ROTATE_MB, see Output.RotatingSink
 if SAFE_CSV:
-	csv_output_file='./output/csv/twitter_'+date.today().strftime("%Y-%m-%d")+'.csv'
-	if not(os.path.exists(csv_output_file) and os.path.isfile(csv_output_file)):
-		with open(csv_output_file, 'a') as f:
-			wr=csv.writer(f, dialect='excel')
-			header=['Created At', 'User Id', 'User Language', 'User timezone',
-				'User Location', 'User Place Country Code from Twitter',
-				'User URL', 'User Description', 'User name', 'Tweet',
-				'Inferred Country', 'Inferred Dimension', 'Inference Strength',
-				'Ratio of Followers', 'Hashtags', 'User Mentions', 'URLs', 'Media'] 
-			wr.writerow(header)
+	csv_sink=Output.RotatingSink(output_dir+'csv/', '.csv', lambda filename: Output.CSVSink(filename, header=Enrichment.header),
+		compress=Output.gzip_file if COMPRESS_CLOSED else None)
+if SAFE_JSON:
+	json_sink=Output.RotatingSink(output_dir+'json/', Archive.EXTENSIONS[JSON_COMPRESSION], Archive.ArchiveSink,
+		compress=Archive.compress if COMPRESS_CLOSED and not JSON_COMPRESSION else None)
+if SAFE_PARQUET:
+	parquet_sink=Output.RotatingSink(output_dir+'parquet/', '.parquet', lambda filename: Output.ParquetSink(filename, Enrichment.header, Enrichment.column_types))
+if SAFE_SQLITE:
+	# one database for all days, committed at every flush
+	sqlite_sink=Output.SQLiteSink(output_dir+'db/twitter.sqlite', Enrichment.header, Enrichment.column_types)
+if SAFE_AGGREGATES:
+	# counts per country and dimension for the dashboards, see Aggregates.py
+	if not os.path.exists(output_dir): os.makedirs(output_dir)
+	aggregates=Aggregates.Aggregates(output_dir+'aggregates.json')
+row_sinks=[sink for sink in (csv_sink, parquet_sink, sqlite_sink, aggregates) if sink is not None]
+started=startup_phase('opening the outputs', started)
+
+pipeline=None
+scheduler=Reconnect.ReconnectScheduler()
+client=None # the StreamClient with --connections
+
+def cache_hit_rate():
+	if not CLASSIFIER_CACHE_SIZE or c2.current is None: return None
+	counters=c2.current[1].counters
+	return float(counters['hits'])/max(1, counters['hits']+counters['misses'])
+
+def profile_hit_rate():
+	if enricher.profiles is None: return None
+	counters=enricher.profiles.counters
+	return float(counters['hits'])/max(1, counters['hits']+counters['misses'])
+
+metrics.gauge('queue_depth', lambda: pipeline.qsize() if pipeline is not None else None)
+metrics.gauge('cache_hit_rate', cache_hit_rate)
+metrics.gauge('profile_hit_rate', profile_hit_rate)
+metrics.gauge('downtime_seconds', scheduler.downtime)
+
+def save_json(data):
+	with metrics.timer('archive'):
+		json_sink.write(data)
+
+def save_row(tweet):
+	with metrics.timer('write'):
+		for sink in row_sinks: sink.write(tweet)
+	metrics.inc('written')
+
+def save_tweet(data, tweet):
+	"""Pipeline writer: saves the raw tweet and its enriched CSV row (None when enrichment failed)"""
+	if tweet is Enrichment.DUPLICATE or tweet is Enrichment.FILTERED: return
+	if SAFE_JSON: save_json(data)
+	metrics.inc('added')
+	if tweet is not None: save_row(tweet)
 
 ############################## Catching Ctrl+C ##########################
-def signal_handler(signal, frame):
-	try: # we could also do commit here if using DB
-		global tweets_added 
-		if PRINT_DEBUG:
-			print('You pressed Ctrl+C or Killed the process. Your data were saved to DB.')
-			print "Tweets added: %s"%str(tweets_added)
-	except:
-		if PRINT_DEBUG: print('Exception while saving the results in signal_handler.')
-	sys.exit(0)
+stopping=False # set by signal_handler, the collector stops and closes its outputs in shutdown()
+stream=None # the tweepy Stream without --connections
+
+def signal_handler(signum, frame):
+	"""Only stops the stream: the main thread may be holding a lock of the pipeline or the metrics"""
+	global stopping
+	stopping=True
+	# a second Ctrl+C or the SIGTERM of supervise_tweets.py must not interrupt shutdown()
+	signal.signal(signal.SIGINT, signal.SIG_IGN)
+	signal.signal(signal.SIGTERM, signal.SIG_IGN)
+	if client is not None: client.stop()
+	if stream is not None: stream.disconnect()
+
+def shutdown():
+	"""Writes everything queued and closes the outputs, closing the sinks commits the last rows into the database"""
+	if pipeline is not None:
+		pipeline.close()
+		if PRINT_DEBUG: print "Pipeline: %s"%pipeline.counters
+	if PRINT_DEBUG: print "Missing fields: %s"%enricher.missing_fields()
+	if PRINT_DEBUG: print "Filtered: %s"%enricher.prefilter.counters
+	if PRINT_DEBUG and enricher.dedup is not None: print "Duplicates: %s"%enricher.dedup.stats()
+	if PRINT_DEBUG: print "Stream connections: %s"%(client.stats() if client is not None else scheduler.counters)
+	if PRINT_DEBUG and enricher.profiles is not None: print "Profile cache: %s"%enricher.profiles.counters
+	if PRINT_DEBUG and CLASSIFIER_CACHE_SIZE and c2.current is not None: print "Classifier cache: %s"%c2.current[1].counters
+	saved=True
+	for sink in row_sinks+[json_sink]:
+		if sink is None: continue
+		try:
+			sink.close()
+		except Exception as e: # the other sinks are closed all the same
+			saved=False
+			metrics.error(e)
+			print >>sys.stderr, "Failed to close %s: %s"%(sink.__class__.__name__, e)
+	if PRINT_DEBUG:
+		print('You pressed Ctrl+C or Killed the process. %s'%('Your data were saved.' if saved else 'Some outputs could not be closed.'))
+		print "Tweets added: %d"%metrics.total('added')
+	return saved
 
 signal.signal(signal.SIGINT, signal_handler)
 signal.signal(signal.SIGTERM, signal_handler)
@@ -95,157 +180,60 @@ print('Press Ctrl+C to stop the data collection. See the JSON or CSV files in th
 ############################## Listening to the Twitter Stream ##########################
 class StdOutListener(StreamListener):
 
-    def on_data(self, data):
-    	global tweets_added
-        try:
-        	tweet = json.loads(data)
-        	if SAFE_JSON:
-        		with open('./output/json/twitter_'+date.today().strftime("%Y-%m-%d")+'.txt', 'a') as f:
-  					json.dump(data, f, ensure_ascii=False)
-	    	tweets_added+=1
-	    	self.on_status(tweet)
-
-  
-        except BaseException as e:
-            if PRINT_DEBUG: print('Failed: ', str(e))
-            time.sleep(1)
-
-			
-    def on_error(self, status):
-        if PRINT_DEBUG: print('Error: ', status)
-
-    def on_status(self, status):
-
-
-		tweet=[]
-		
-		try:
-			tweet.append(time.strftime('%Y-%m-%d %H:%M:%S',time.strptime(status['created_at'],'%a %b %d %H:%M:%S +0000 %Y')))
-		except:
-			tweet.append('')
-
-		try:
-			tweet.append(status["user"]["id"])
-		except:
-			tweet.append('')
-
-		try:
-			user_language=status["user"]["lang"]
-			tweet.append(user_language)
-		except:
-			tweet.append('')
-			user_language=''
-
-		try:
-			user_time_zone=status["user"]["time_zone"].encode("utf-8")
-			tweet.append(user_time_zone)
-		except:
-			tweet.append('')
-			user_time_zone=''
-
-		try:
-			user_location=status["user"]["location"].encode("utf-8")
-			tweet.append(user_location)
-		except:
-			tweet.append('')
-			user_location=""
-				
-		try:
-			user_country_code=status["place"]["country_code"]
-			tweet.append(user_country_code)
-		except:
-			user_country_code=""
-			tweet.append(user_country_code)
-
-		try:
-			tweet.append(status["user"]["url"])
-		except:
-			tweet.append('')
-
+	connecting=None # start time of the first stream connection, see startup_phase()
+	error=None # why the stream stopped: HTTP status code or 'timeout'
+
+	def on_connect(self):
+		scheduler.connected()
+
+	def on_data(self, data):
+		if stopping: return False
+		if self.connecting:
+			startup_phase('connecting to the stream', self.connecting)
+			self.connecting=None
+		metrics.inc('received')
+		if pipeline is not None:
+			pipeline.submit(data)
+			return True
 		try:
-			tweet.append(status["user"]["description"].encode("utf-8"))
-		except:
-			tweet.append('')
+			tweet = enricher.decode(data)
+			if not enricher.wanted(tweet) or enricher.duplicate(tweet): return True
+			if SAFE_JSON: save_json(data)
+			metrics.inc('added')
+			self.on_status(tweet)
 
-		try:
-			tweet.append(status["user"]["name"].encode("utf-8"))
-		except:
-			tweet.append('')
-			
-		try:
-			tweet.append(status["user"]["screen_name"].encode("utf-8"))
-		except:
-			tweet.append('')
-
-		try:
-			tweet.append(status["text"].encode("utf-8"))
-		except:
-			tweet.append('')
-		
-		try:
-			meta_text=user_language+' '+user_time_zone+' '+user_location
-			inferred_country_meta, inferred_dimension_meta=c2.ClassifyTextToCountryDimension(meta_text)
 		except Exception as e:
-			if PRINT_DEBUG: print e.message
-			inferred_country_meta=inferred_dimension_meta=""
-
-		if PRINT_DEBUG: print "inferred_country_meta=%s, inferred_dimension_meta=%s"%(inferred_country_meta, inferred_dimension_meta)
-
-		try:
-			tweet.append(inferred_country_meta)
-		except:
-			tweet.append('')
-
-		try:
-			tweet.append(inferred_dimension_meta)
-		except:
-			tweet.append('')
-		_,strength,_=getDimension(inferred_country_meta,user_language)
-		if PRINT_DEBUG: print "Inference strength=%d for inferred_country_meta=%s and user_language=%s"%(strength, inferred_country_meta,user_language)
-		tweet.append(strength)
-		
-		if (int(status['user']['followers_count']+status['user']['friends_count']))>0:
-			tweet.append(int(status['user']['followers_count'])/(int(status['user']['friends_count'])+int(status['user']['followers_count'])))
-		else:
-			tweet.append(0)
-		
-		if 'hashtags' in status['entities']:
-			tweet.append(' '.join([hashtag['text'] for hashtag in status['entities']['hashtags']]))
-		else:
-			tweet.append('')
-
-		if 'user_mentions' in status['entities']:
-			tweet.append(' '.join([user_mention['screen_name'] for user_mention in status['entities']['user_mentions']]))
-		else:
-			tweet.append('')
-		
-		if 'urls' in status['entities']:
-			tweet.append(' '.join([url['expanded_url'] for url in status['entities']['urls']]))
-		else:
-			tweet.append('')
-	
-		if 'media' in status['entities']:
-			tweet.append(' '.join([media['media_url'] for media in status['entities']['media']]))   
-		else:
-			tweet.append('')
-
+			metrics.error(e)
+			if PRINT_DEBUG and sampled(): print('Failed: ', str(e))
 
-		if SAFE_CSV:
-			with open(csv_output_file, 'a') as f:
-				wr=csv.writer(f, dialect='excel')
-				wr.writerow(tweet)
-
-		
+	def on_status(self, status):
+		tweet=enricher.enrich(status)
+		save_row(tweet)
 		return True
 
-	 
-    def on_error(self, status):
-        print status
+		 
+	def on_error(self, status):
+		print status
+		# stop the stream, the reconnect scheduler decides when to connect again
+		self.error=status
+		return False
+
+	def on_timeout(self):
+		self.error='timeout'
+		return False
 
+	def on_closed(self):
+		# Twitter closed the stream, stop it as after an error (see Reconnect.ScheduledStream)
+		self.error=None
+		return False
 
 
 if __name__ == '__main__':
 	l = StdOutListener()
+	# the event loop of the StreamClient only reads, the tweets are enriched and written in the pipeline
+	if PIPELINE_MODE or args.connections:
+		pipeline = Pipeline.Pipeline(enricher.process, save_tweet).start()
+	metrics.start(port=args.metrics_port)
 	try:
 		auth = OAuthHandler(consumer_key, consumer_secret)
 		auth.set_access_token(oauth_token, oauth_secret)
@@ -254,20 +242,36 @@ if __name__ == '__main__':
 		print type(e)
 		print e
 		print e.args
-	
-	while True:
-		stream = Stream(auth, l)
-	
-		try:
-			stream.filter(track=STREAM_FILTER)
-		except Exception as e:
-			if PRINT_DEBUG: 
-				print "~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~"
-				print e
-			if str(e)=="420": 
-				if PRINT_DEBUG: print "I will sleep for 20 seconds before starting to collect again ..."
-				time.sleep(20)
-			if PRINT_DEBUG: print "~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~"
-			continue
+	started=startup_phase('authentication', started)
+	l.connecting=started
+
+	if args.connections:
+		import StreamClient
+		from supervise_tweets import split_keywords
+		client = StreamClient.StreamClient(auth, split_keywords(track, args.connections), l.on_data,
+			host=args.fake_stream or 'stream.twitter.com', secure=not args.fake_stream)
+		metrics.gauge('downtime_seconds', client.downtime)
+		if not stopping: client.run()
+	else:
+		if args.fake_stream:
+			import FakeStream
+			stream = FakeStream.PlainStream(auth, l, host=args.fake_stream, timeout=STREAM_TIMEOUT)
+		else:
+			stream = Reconnect.ScheduledStream(auth, l, timeout=STREAM_TIMEOUT)
+
+		while not stopping:
+			l.error = None
+			try:
+				stream.filter(track=track)
+				error = l.error # None when the connection was closed
+			except Exception as e:
+				if stopping: break # the signal interrupted the read
+				if PRINT_DEBUG: 
+					print "~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~"
+					print e
+					print "~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~"
+				error = e
+			if not stopping: scheduler.wait(error)
+	sys.exit(0 if shutdown() else 1)
 
 
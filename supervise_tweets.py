@@ -0,0 +1,309 @@
+# -*- coding: utf-8 -*-
+#######################################################################
+###   supervise_tweets.py: Collecting with one process per shard    ###
+###   Copyright:     Elena Daehnhardt                               ###
+###   Contact me at: edaehn@gmail.com                               ###
+#######################################################################
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Runs save_tweets.py in several processes, each following a share of the
+# STREAM_FILTER keywords with its own stream connection:
+#
+#   python supervise_tweets.py [--shards N]
+#
+# Every collector writes into ./output/shards/<shard>/. The CSV rows and the
+# JSON archives of the shards are appended to the daily files in ./output/
+# once a shard has finished a day, and when its collector stops. The Parquet
+# files cannot be appended to, they are moved into ./output/parquet/ with the
+# shard in their name. The tweets of the SQLite database of a shard are moved
+# into ./output/db/twitter.sqlite on every merge, also while its collector is
+# writing, and the aggregates of the shards are added up into
+# ./output/aggregates.json every AGGREGATE_INTERVAL seconds. A collector
+# which stops is started again, the counts of every shard are printed on
+# every merge and at the end.
+#
+# The supervisor does not serve metrics itself. With METRICS_PORT the
+# collector of shard N serves its metrics on port METRICS_PORT+N, the shards
+# being numbered from 0.
+#
+# Twitter allows few stream connections per application, every shard may
+# need credentials of its own.
+
+import os
+import sys
+import csv
+import json
+import gzip
+import glob
+import time
+import signal
+import shutil
+import sqlite3
+import argparse
+import subprocess
+import multiprocessing
+from datetime import date
+from config import *
+import Output
+import Archive
+import Enrichment
+import Aggregates
+
+basedir=os.path.abspath(os.path.dirname(__file__))
+
+def split_keywords(keywords,shards):
+	'''Splits the keywords into at most shards lists of about the same length'''
+	shards=max(1,min(shards,len(keywords)))
+	return [keywords[shard::shards] for shard in range(shards)]
+
+def day_of(filename):
+	'''Returns the YYYY-MM-DD date of an output file twitter_YYYY-MM-DD...'''
+	return os.path.basename(filename)[len('twitter_'):len('twitter_YYYY-MM-DD')]
+
+def merge_csv(filename,output_file):
+	'''Appends the rows of a shard CSV file to the daily CSV file, returns the number of rows'''
+	sink=Output.CSVSink(output_file, header=Enrichment.header, flush_rows=10000)
+	rows=0
+	with (gzip.open if filename.endswith('.gz') else open)(filename,'rb') as f:
+		reader=csv.reader(f, dialect='excel')
+		try:
+			next(reader,None) # header
+			for row in reader:
+				sink.write(row)
+				rows+=1
+		except csv.Error as e:
+			# a collector killed while writing leaves a partial row at the end
+			print >>sys.stderr, "%s: skipping the rest of the file, %s"%(filename,e)
+	sink.close()
+	return rows
+
+def merge_archive(filename,output_file):
+	'''Appends the tweets of a shard archive to the daily archive, returns the number of tweets'''
+	sink=Archive.ArchiveSink(output_file, compression=Archive.compression_of(filename), flush_rows=10000)
+	tweets=0
+	for data in Archive.read_archive(filename):
+		sink.write(data)
+		tweets+=1
+	sink.close()
+	return tweets
+
+def merge_sqlite(filename,output_file,slice_rows=10000):
+	'''Moves the tweets of a shard database into the main database with new ids, returns the number
+	of tweets. Every slice of slice_rows tweets is moved in a transaction of its own, so that the
+	collector writing into the shard database meanwhile only waits for a short time.'''
+	sink=Output.SQLiteSink(output_file, Enrichment.header, Enrichment.column_types) # creates the tables
+	tables=[(table,name) for _,table,name in sink.normalized]
+	sink.close()
+	db=sqlite3.connect(output_file,isolation_level=None,timeout=60)
+	moved=0
+	try:
+		db.execute('ATTACH DATABASE ? AS shard',(filename,))
+		columns=', '.join(column[1] for column in db.execute('PRAGMA shard.table_info(tweets)') if column[1]!='id')
+		while columns:
+			db.execute('BEGIN IMMEDIATE')
+			try:
+				first=db.execute('SELECT MIN(id) FROM shard.tweets').fetchone()[0]
+				if first is None:
+					db.execute('COMMIT')
+					break
+				last=first+slice_rows-1
+				offset=db.execute('SELECT COALESCE(MAX(id), 0)+1 FROM main.tweets').fetchone()[0]-first
+				moved+=db.execute('INSERT INTO main.tweets (id, %s) SELECT id+?, %s FROM shard.tweets WHERE id<=?'%(columns,columns),(offset,last)).rowcount
+				for table,name in tables:
+					db.execute('INSERT INTO main.%s (tweet, %s) SELECT tweet+?, %s FROM shard.%s WHERE tweet<=?'%(table,name,name,table),(offset,last))
+					db.execute('DELETE FROM shard.%s WHERE tweet<=?'%table,(last,))
+				db.execute('DELETE FROM shard.tweets WHERE id<=?',(last,))
+				db.execute('COMMIT')
+			except:
+				db.execute('ROLLBACK')
+				raise
+	finally:
+		db.close()
+	return moved
+
+def complete_parquet(filename):
+	'''A Parquet file ends with its footer when the writer has closed it'''
+	with open(filename,'rb') as f:
+		f.seek(0,os.SEEK_END)
+		if f.tell()<8: return False
+		f.seek(-4,os.SEEK_END)
+		return f.read(4)=='PAR1'
+
+def move_parquet(filename,output_file):
+	'''Moves a complete shard Parquet file to the daily outputs, returns the number of files moved'''
+	if not complete_parquet(filename):
+		print >>sys.stderr, "%s: incomplete Parquet file, not moved"%filename
+		return 0
+	base,extension=os.path.splitext(output_file)
+	number=0
+	while os.path.exists(output_file):
+		number+=1
+		output_file='%s.%d%s'%(base,number,extension)
+	shutil.move(filename,output_file)
+	return 1
+
+
+class Shard:
+	'''A save_tweets.py collector following some of the keywords, and its counts'''
+
+	def __init__(self,number,keywords,output_dir):
+		self.number=number
+		self.keywords=keywords
+		self.output_dir=os.path.join(output_dir,'shards','%d'%number,'')
+		self.main_dir=output_dir
+		self.process=None
+		self.started=None
+		self.restart_at=time.time()
+		self.delay=SHARD_RESTART_DELAY
+		self.counters={'starts':0, 'restarts':0, 'crashes':0, 'rows':0, 'tweets':0, 'parquet_files':0, 'db_rows':0}
+
+	def start(self):
+		# the collector of every shard serves its metrics on a port of its own
+		metrics_port=METRICS_PORT+self.number if METRICS_PORT else 0
+		self.process=subprocess.Popen([sys.executable, os.path.join(basedir,'save_tweets.py'),
+			'--track', ','.join(self.keywords), '--output', self.output_dir,
+			'--metrics-port', '%d'%metrics_port])
+		self.started=time.time()
+		if self.counters['starts']: self.counters['restarts']+=1
+		self.counters['starts']+=1
+		print "Shard %d: collector %d started for %s"%(self.number,self.process.pid,', '.join(self.keywords))
+
+	def running(self):
+		return self.process is not None and self.process.poll() is None
+
+	def stopped(self):
+		'''Called when the collector has stopped: merges its outputs and schedules the restart'''
+		code=self.process.returncode
+		self.process=None
+		if code!=0: self.counters['crashes']+=1
+		print >>sys.stderr, "Shard %d: collector stopped with exit code %s"%(self.number,code)
+		self.merge()
+		if time.time()-self.started<SHARD_MIN_UPTIME:
+			self.delay=min(self.delay*2,SHARD_RESTART_MAX)
+		else:
+			self.delay=SHARD_RESTART_DELAY
+		self.restart_at=time.time()+self.delay
+
+	def interrupt(self):
+		if self.running(): self.process.send_signal(signal.SIGINT)
+
+	def merge(self,past_days_only=False):
+		'''Merges the shard outputs into the daily outputs. While the collector is running
+		only the files of the past days which it no longer writes are merged.'''
+		today=date.today().strftime("%Y-%m-%d")
+		def finished(filename):
+			if day_of(filename)>=today or time.time()-os.path.getmtime(filename)<SHARD_MERGE_INTERVAL: return False
+			return not filename.endswith('.parquet') or complete_parquet(filename)
+		for kind,pattern,merge,counter in [('csv','*.csv*',merge_csv,'rows'),
+				('json','*.jsonl*',merge_archive,'tweets'), ('parquet','*.parquet',move_parquet,'parquet_files')]:
+			for filename in sorted(glob.glob(os.path.join(self.output_dir,kind,pattern))):
+				if filename.endswith('.idx') or filename.endswith('.tmp') or (past_days_only and not finished(filename)): continue
+				output_file=os.path.join(self.main_dir,kind,os.path.basename(filename))
+				if kind=='csv' and output_file.endswith('.gz'): output_file=output_file[:-len('.gz')]
+				if kind=='parquet':
+					output_file='%s.shard%d.parquet'%(output_file[:-len('.parquet')],self.number)
+				if not os.path.exists(os.path.dirname(output_file)): os.makedirs(os.path.dirname(output_file))
+				self.counters[counter]+=merge(filename,output_file)
+				if kind!='parquet':
+					os.remove(filename)
+					if os.path.exists(filename+'.idx'): os.remove(filename+'.idx')
+		# one database for all days, its tweets are moved while the collector is writing more
+		database=os.path.join(self.output_dir,'db','twitter.sqlite')
+		if os.path.exists(database):
+			output_file=os.path.join(self.main_dir,'db','twitter.sqlite')
+			if not os.path.exists(os.path.dirname(output_file)): os.makedirs(os.path.dirname(output_file))
+			self.counters['db_rows']+=merge_sqlite(database,output_file)
+
+
+class Supervisor:
+	'''Starts a collector per shard, restarts those which stop and merges their outputs'''
+
+	def __init__(self,keywords,shards,output_dir='./output/'):
+		self.shards=[Shard(number,shard_keywords,output_dir) for number,shard_keywords in enumerate(split_keywords(keywords,shards))]
+		self.output_dir=output_dir
+		self.stopping=False
+		self.signal=None # the signal which stopped the supervisor
+
+	def stop(self,signum,frame):
+		self.stopping=True
+		self.signal=signum
+
+	def run(self):
+		last_merge=last_aggregates=time.time()
+		while not self.stopping:
+			for shard in self.shards:
+				if shard.process is not None and not shard.running(): shard.stopped()
+				if shard.process is None and time.time()>=shard.restart_at: shard.start()
+			if time.time()-last_merge>=SHARD_MERGE_INTERVAL:
+				for shard in self.shards: shard.merge(past_days_only=True)
+				self.print_counters()
+				last_merge=time.time()
+			if SAFE_AGGREGATES and time.time()-last_aggregates>=AGGREGATE_INTERVAL:
+				self.merge_aggregates()
+				last_aggregates=time.time()
+			time.sleep(1)
+		self.stop_collectors()
+		for shard in self.shards:
+			if shard.process is not None: shard.process.wait()
+			shard.merge()
+		if SAFE_AGGREGATES: self.merge_aggregates()
+		self.print_counters()
+
+	def merge_aggregates(self):
+		'''Adds up the aggregates.json of the shards into the aggregates.json of the main output directory'''
+		snapshots=[]
+		for shard in self.shards:
+			filename=os.path.join(shard.output_dir,'aggregates.json')
+			if os.path.exists(filename):
+				with open(filename) as f: snapshots.append(json.load(f))
+		if not snapshots: return
+		if not os.path.exists(self.output_dir): os.makedirs(self.output_dir)
+		Aggregates.write_snapshot(os.path.join(self.output_dir,'aggregates.json'),Aggregates.merge_snapshots(snapshots))
+
+	def wait(self,timeout):
+		'''Waits at most timeout seconds for the collectors to exit, returns the shards still running'''
+		deadline=time.time()+timeout
+		while time.time()<deadline and any(shard.running() for shard in self.shards): time.sleep(0.1)
+		return [shard for shard in self.shards if shard.running()]
+
+	def stop_collectors(self,timeout=SHARD_STOP_TIMEOUT):
+		'''The collectors close their outputs after a SIGINT: Ctrl+C reaches them too, a SIGTERM of
+		the supervisor alone is passed on as SIGINT. A collector ignores any further signal while
+		closing, so it only gets a SIGTERM (in case the SIGINT came before its signal handler was
+		set) when still running after timeout seconds, and is killed after as long again.'''
+		if self.signal!=signal.SIGINT:
+			for shard in self.shards: shard.interrupt()
+		for action,doing in (('terminate','terminating'),('kill','killing')):
+			for shard in self.wait(timeout):
+				print >>sys.stderr, "Shard %d: collector %d still running after %ds, %s it"%(shard.number,shard.process.pid,timeout,doing)
+				getattr(shard.process,action)()
+
+	def print_counters(self):
+		print "%-6s %-8s %-6s %-8s %-7s %10s %10s  %s"%('shard','pid','starts','restarts','crashes','rows','tweets','keywords')
+		for shard in self.shards:
+			counters=shard.counters
+			print "%-6d %-8s %-6d %-8d %-7d %10d %10d  %s"%(shard.number, shard.process.pid if shard.running() else '-',
+				counters['starts'], counters['restarts'], counters['crashes'], counters['rows'], counters['tweets'], ', '.join(shard.keywords))
+
+
+if __name__ == '__main__':
+	parser=argparse.ArgumentParser(description='Runs a save_tweets.py collector for every shard of the STREAM_FILTER keywords')
+	parser.add_argument('--shards', type=int, default=STREAM_SHARDS, help='number of collectors, one per CPU core by default')
+	args=parser.parse_args()
+
+	supervisor=Supervisor(STREAM_FILTER,args.shards or multiprocessing.cpu_count())
+	# Ctrl+C reaches the collectors too, SIGTERM is passed on as SIGINT by run()
+	signal.signal(signal.SIGINT, supervisor.stop)
+	signal.signal(signal.SIGTERM, supervisor.stop)
+	print('Press Ctrl+C to stop the data collection. See the JSON or CSV files in the related /output directories')
+	supervisor.run()
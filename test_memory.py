@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+#######################################################################
+###   test_memory.py: Bounded memory of a long-running collector    ###
+###   Copyright:     Elena Daehnhardt                               ###
+###   Contact me at: edaehn@gmail.com                               ###
+#######################################################################
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# A collector runs for weeks, every tweet with a new id and many with a new
+# user. The tweets of a synthetic corpus, repeated with new ids every round
+# (see Corpus.cycled()), are enriched and written with small caches, which
+# must stay within their sizes, and the memory must stop growing once they
+# are full. test_memory_flat streams TEST_MEMORY_TWEETS tweets, a million by
+# default, which takes several minutes; set it lower for a quick run:
+#
+#   python -m unittest -v test_memory
+#   TEST_MEMORY_TWEETS=100000 python -m unittest -v test_memory
+
+import os
+import shutil
+import tempfile
+import unittest
+from config import *
+import Corpus
+import Dedup
+import Models
+import Output
+import Filters
+import Classifier
+import Enrichment
+import bench_tweets
+
+CORPUS_TWEETS=2000
+BATCH=100
+TWEETS=int(os.environ.get('TEST_MEMORY_TWEETS',1000000))
+
+def rss_mb():
+	'''The resident memory of this process in MB, now and not at its peak'''
+	with open('/proc/self/statm') as f:
+		return int(f.read().split()[1])*os.sysconf('SC_PAGE_SIZE')/1024./1024.
+
+
+class MemoryTest(unittest.TestCase):
+
+	@classmethod
+	def setUpClass(cls):
+		cls.workdir=tempfile.mkdtemp(prefix='test_memory_')
+		bench_tweets.make_stub_model(os.path.join(cls.workdir,'models'))
+		cls.corpus=Corpus.synthetic_tweets(CORPUS_TWEETS)
+
+	@classmethod
+	def tearDownClass(cls):
+		shutil.rmtree(cls.workdir,ignore_errors=True)
+
+	def setUp(self):
+		classifier=Models.load_model('stub',models_dir=os.path.join(self.workdir,'models'))
+		if isinstance(classifier,Classifier.CachedClassifier): classifier=classifier.classifier
+		self.classifier=Classifier.CachedClassifier(classifier,size=5)
+		self.enricher=Enrichment.Enricher(Models.StaticModel('stub',self.classifier),
+			dedup=Dedup.Deduplicator(memory_mb=1,recent=1000),prefilter=Filters.Filter())
+		self.enricher.profiles=Enrichment.ProfileCache(size=500)
+		self.sink=Output.CSVSink(os.path.join(self.workdir,'tweets.csv'),header=Enrichment.header)
+		self.duplicates=0
+
+	def tearDown(self):
+		self.sink.close()
+
+	def stream(self,tweets,first=0):
+		'''Enriches and writes the tweets first to first+tweets of the cycled corpus'''
+		batch=[]
+		for number,data in enumerate(Corpus.cycled(self.corpus,first+tweets)):
+			if number<first: continue
+			batch.append(data)
+			if len(batch)==BATCH:
+				self.write(batch)
+				batch=[]
+		if batch: self.write(batch)
+
+	def write(self,batch):
+		for row in self.enricher.process(batch):
+			if row=='duplicate':
+				# a false positive of the Bloom filters, a few in a million new ids
+				self.duplicates+=1
+				continue
+			self.assertTrue(isinstance(row,list),'a tweet was not enriched: %r'%(row,))
+			self.sink.write(row)
+
+	def test_caches_bounded(self):
+		dedup=self.enricher.dedup
+		filter_bytes=len(dedup.current.array)
+		self.stream(10*CORPUS_TWEETS)
+		# every round has new tweet ids, so none is a duplicate, and new users
+		self.assertEqual(dedup.counters['duplicates'],0)
+		self.assertEqual(dedup.counters['checked'],10*CORPUS_TWEETS)
+		self.assertTrue(self.enricher.profiles.counters['evictions']>0)
+		self.assertTrue(len(self.enricher.profiles.profiles)<=500)
+		self.assertTrue(len(dedup.recent)<=1000)
+		self.assertEqual(len(dedup.current.array),filter_bytes)
+		self.assertTrue(dedup.previous is None or len(dedup.previous.array)==filter_bytes)
+		self.assertTrue(len(self.classifier.cache)<=5)
+
+	@unittest.skipUnless(os.path.exists('/proc/self/statm'),'needs /proc to read the resident memory')
+	def test_memory_flat(self):
+		warm_up=5*CORPUS_TWEETS
+		self.assertTrue(TWEETS>warm_up,'TEST_MEMORY_TWEETS must be more than the %d tweets of the warm-up'%warm_up)
+		self.stream(warm_up)
+		warm_rss=rss_mb()
+		self.stream(TWEETS-warm_up,first=warm_up)
+		dedup=self.enricher.dedup
+		self.assertEqual(dedup.counters['checked'],TWEETS)
+		self.assertEqual(dedup.counters['recent_hits'],0)
+		self.assertTrue(self.duplicates<=2*DEDUP_FP_RATE*TWEETS+10,'%d tweets taken for duplicates'%self.duplicates)
+		growth=rss_mb()-warm_rss
+		self.assertTrue(growth<10,'the memory grew by %.1f MB after the warm-up'%growth)
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+#######################################################################
+###   test_reconnect.py: Reconnecting after the stream was closed   ###
+###   Copyright:     Elena Daehnhardt                               ###
+###   Contact me at: edaehn@gmail.com                               ###
+#######################################################################
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# A FakeStream.py server closes every connection after one tweet, the stream
+# must return from filter() each time so that the scheduler waits before
+# connecting again, as in save_tweets.py:
+#
+#   python -m unittest -v test_reconnect
+
+import threading
+import unittest
+from tweepy import OAuthHandler
+from tweepy.streaming import StreamListener
+import Corpus
+import FakeStream
+import Reconnect
+
+ROUNDS=5
+
+class _Listener(StreamListener):
+
+	def __init__(self,scheduler):
+		StreamListener.__init__(self)
+		self.scheduler=scheduler
+		self.error='never connected'
+		self.tweets=0
+
+	def on_connect(self):
+		self.scheduler.connected()
+
+	def on_data(self,data):
+		self.tweets+=1
+		return True
+
+	def on_error(self,status):
+		self.error=status
+		return False
+
+	def on_closed(self):
+		self.error=None
+		return False
+
+
+class ReconnectTest(unittest.TestCase):
+
+	def setUp(self):
+		self.server=FakeStream.FakeStreamServer(('localhost',0),['stream:1'],Corpus.synthetic_tweets(10)).start()
+
+	def tearDown(self):
+		self.server.stop()
+
+	def test_waits_after_clean_close(self):
+		delays=[]
+		scheduler=Reconnect.ReconnectScheduler(sleep=delays.append)
+		listener=_Listener(scheduler)
+		auth=OAuthHandler('key','secret')
+		auth.set_access_token('token','secret')
+		stream=FakeStream.PlainStream(auth,listener,host='localhost:%d'%self.server.server_address[1],timeout=10)
+		def collect():
+			for _ in range(ROUNDS):
+				stream.filter(track=['test'])
+				scheduler.wait(listener.error)
+		thread=threading.Thread(target=collect)
+		thread.daemon=True
+		thread.start()
+		thread.join(30)
+		stream.disconnect()
+		self.assertFalse(thread.is_alive(),'filter() did not return after the stream was closed')
+		self.assertEqual(self.server.connections,ROUNDS)
+		self.assertEqual(len(delays),ROUNDS)
+		self.assertEqual(listener.tweets,ROUNDS)
+		self.assertEqual(scheduler.counters['network'],ROUNDS)
+
+
+if __name__ == '__main__':
+	unittest.main()
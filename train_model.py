@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+#######################################################################
+###   train_model.py: Training the META models on collected tweets  ###
+###   Copyright:     Elena Daehnhardt                               ###
+###   Contact me at: edaehn@gmail.com                               ###
+#######################################################################
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Trains a META classifier on the outputs of save_tweets.py, labelled by the
+# country code of the place which Twitter attaches to some tweets:
+#
+#   python train_model.py [--name NAME] [--models DIR] [--epochs N] output/csv/*.csv output/json/*.jsonl ...
+#
+# The CSV files (also gzipped), Parquet files and JSON archives are read in
+# chunks of TRAIN_CHUNK_ROWS rows, the CSV files by the C parser of pandas
+# and only in the four columns needed. The meta texts are built as in
+# Enrichment.py (user language, time zone and location), the same texts of
+# a chunk are counted once with their number as the sample weight, hashed
+# into 2**TRAIN_FEATURE_BITS features and learnt with partial_fit, so the
+# memory stays the same for any number of rows: the model takes the number
+# of countries times 2**TRAIN_FEATURE_BITS floats. The accuracy printed for
+# every chunk is measured before the chunk is learnt (progressive validation).
+#
+# The model is saved as ./models/NAME/META, a Classifier with labels['Country'],
+# where the collectors load it (see Models.py).
+
+import os
+import sys
+import time
+import argparse
+import itertools
+import pandas
+from sklearn.pipeline import Pipeline
+from sklearn.feature_extraction.text import HashingVectorizer
+from sklearn.linear_model import SGDClassifier
+from config import *
+import Archive
+import Decoder
+import Enrichment
+import Classifier
+import Models
+from Locality import loadLocalities
+
+META_COLUMNS=Enrichment.header[Enrichment.LANGUAGE_COLUMN:Enrichment.LANGUAGE_COLUMN+3]
+LABEL_COLUMN='User Place Country Code from Twitter'
+
+def frame(rows):
+	'''DataFrame of the meta columns and the label column of rows'''
+	return pandas.DataFrame(rows,columns=META_COLUMNS+[LABEL_COLUMN])
+
+def read_csv(filename,chunk_rows):
+	# the older CSV files have a value more than header names in every row, which would become the index
+	for chunk in pandas.read_csv(filename,usecols=META_COLUMNS+[LABEL_COLUMN],dtype=str,keep_default_na=False,index_col=False,
+			chunksize=chunk_rows,compression='gzip' if filename.endswith('.gz') else None):
+		yield chunk
+
+def read_parquet(filename,chunk_rows):
+	import pyarrow.parquet
+	parquet_file=pyarrow.parquet.ParquetFile(filename)
+	for group in range(parquet_file.num_row_groups):
+		yield parquet_file.read_row_group(group,columns=META_COLUMNS+[LABEL_COLUMN]).to_pandas()
+
+def read_json(filename,chunk_rows):
+	'''The columns of the tweets of a JSON archive, extracted as by the collector'''
+	enricher=Enrichment.Enricher(None,loads=Decoder.get_decoder(partial=True,fields=('user','place')))
+	f=None
+	if filename.endswith('.txt'):
+		f=open(filename,'rb')
+		records=(data for _,data in Archive.read_literals(f))
+	else:
+		records=Archive.read_archive(filename)
+	columns=range(Enrichment.LANGUAGE_COLUMN,Enrichment.LANGUAGE_COLUMN+4)
+	while True:
+		rows=[]
+		for data in itertools.islice(records,chunk_rows):
+			try:
+				tweet=enricher.extract(enricher.decode(data))[0]
+			except Exception:
+				continue
+			rows.append([tweet[column] for column in columns])
+		if not rows: break
+		yield frame(rows)
+	if f is not None: f.close()
+
+def read_chunks(filenames,chunk_rows):
+	'''Yields DataFrames of the meta and label columns of the files'''
+	for filename in filenames:
+		if '.csv' in filename: chunks=read_csv(filename,chunk_rows)
+		elif filename.endswith('.parquet'): chunks=read_parquet(filename,chunk_rows)
+		else: chunks=read_json(filename,chunk_rows)
+		for chunk in chunks: yield chunk
+
+def meta_texts(chunk,classes):
+	'''Returns the distinct meta texts of the labelled rows of a chunk, their labels and their numbers'''
+	labels=chunk[LABEL_COLUMN].map(classes)
+	labelled=chunk[labels.notnull()]
+	texts=labelled[META_COLUMNS[0]]+' '+labelled[META_COLUMNS[1]]+' '+labelled[META_COLUMNS[2]]
+	counts=pandas.DataFrame({'text':texts.values,'label':labels[labels.notnull()].astype(int).values}).groupby(['text','label']).size()
+	return list(counts.index.get_level_values(0)),counts.index.get_level_values(1).values,counts.values.astype(float)
+
+def train(filenames,countries,chunk_rows=TRAIN_CHUNK_ROWS,feature_bits=TRAIN_FEATURE_BITS,epochs=1):
+	'''Trains the META pipeline on the files, returns it'''
+	classes=dict((country,number) for number,country in enumerate(countries))
+	vectorizer=HashingVectorizer(n_features=2**feature_bits,ngram_range=(1,2),alternate_sign=False)
+	model=SGDClassifier(loss='modified_huber',alpha=1e-6)
+	fitted=False
+	for epoch in range(epochs):
+		rows=labelled=0
+		correct=tested=0.0
+		started=time.time()
+		for chunk in read_chunks(filenames,chunk_rows):
+			rows+=len(chunk)
+			texts,labels,weights=meta_texts(chunk,classes)
+			if not len(texts): continue
+			labelled+=int(weights.sum())
+			features=vectorizer.transform(texts)
+			if fitted:
+				correct+=weights[model.predict(features)==labels].sum()
+				tested+=weights.sum()
+			model.partial_fit(features,labels,classes=range(len(countries)),sample_weight=weights)
+			fitted=True
+			print "Epoch %d: %d rows, %d labelled, %d distinct meta texts in the chunk, accuracy %.3f, %.0f rows/s"%(
+				epoch+1,rows,labelled,len(texts),correct/max(tested,1),rows/max(time.time()-started,1e-6))
+			sys.stdout.flush()
+	if not fitted: raise ValueError('No rows labelled with a known country code in %s'%', '.join(filenames))
+	return Pipeline([('vectorizer',vectorizer),('model',model)])
+
+def save(pipeline,countries,models_dir,name):
+	'''Saves the pipeline as the Classifier models_dir/name/META, returns the file name'''
+	try:
+		import joblib
+	except ImportError:
+		from sklearn.externals import joblib
+	classifier=Classifier.Classifier()
+	classifier.classifier=pipeline
+	classifier.labels={'Country':pandas.DataFrame({'Country':countries})}
+	directory=os.path.join(models_dir,name)
+	if not os.path.isdir(directory): os.makedirs(directory)
+	filename=os.path.join(directory,'META')
+	# not compressed, so that the collectors can memory-map it, and renamed when complete
+	joblib.dump(classifier,filename+'.tmp')
+	os.rename(filename+'.tmp',filename)
+	return filename
+
+if __name__ == '__main__':
+	parser=argparse.ArgumentParser(description='Trains a META model on the CSV, Parquet and JSON outputs of save_tweets.py')
+	parser.add_argument('files', nargs='+', help='CSV (.csv, .csv.gz), Parquet or JSON archive files')
+	parser.add_argument('--name', default=None, help='model name, meta-YYYYMMDD-HHMMSS by default')
+	parser.add_argument('--models', default=Models.models_dir, help='directory of the classification models')
+	parser.add_argument('--chunk-rows', type=int, default=TRAIN_CHUNK_ROWS)
+	parser.add_argument('--feature-bits', type=int, default=TRAIN_FEATURE_BITS)
+	parser.add_argument('--epochs', type=int, default=1, help='passes over the files')
+	args=parser.parse_args()
+
+	countries=sorted(loadLocalities()[0])
+	pipeline=train(args.files,countries,args.chunk_rows,args.feature_bits,args.epochs)
+	filename=save(pipeline,countries,args.models,args.name or time.strftime('meta-%Y%m%d-%H%M%S'))
+	print "Model saved into %s"%filename